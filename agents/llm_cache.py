@@ -0,0 +1,359 @@
+"""Two-tier cache for LLM responses.
+
+Lookups first try an exact key over (system prompt, history, query). On a
+miss, the query is compared against recent queries that were asked in the
+same context, and a close enough paraphrase reuses the stored response.
+Callers can turn the second tier off and accept exact matches only.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+import orjson
+from langchain_core.messages import AIMessage, BaseMessage
+
+from helpers.redis_helper import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.92"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.db")
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?\s*[a-z]?")
+
+
+class CacheBackend(Protocol):
+    """Storage for serialized responses, keyed by exact cache key."""
+
+    async def get(self, key: str) -> Optional[dict]: ...
+
+    async def set(self, key: str, value: dict) -> None: ...
+
+
+class MemoryCacheBackend:
+    """In-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisCacheBackend:
+    """Shares cached responses across workers; Redis handles expiry."""
+
+    def __init__(self, redis_url: str, ttl_seconds: int, prefix: str = "llm_cache:"):
+        self.redis_client = get_redis_client(redis_url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self.redis_client.get(self.prefix + key)
+        return orjson.loads(raw) if raw else None
+
+    async def set(self, key: str, value: dict) -> None:
+        await self.redis_client.set(
+            self.prefix + key, orjson.dumps(value), ex=self.ttl_seconds
+        )
+
+
+class SQLiteCacheBackend:
+    """Persists cached responses on local disk so they survive restarts."""
+
+    # Expired and excess rows are pruned every this many writes, not on each one
+    PRUNE_EVERY_WRITES = 64
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_expires_at ON llm_cache (expires_at)"
+            )
+            self._prune()
+
+    def _prune(self) -> None:
+        """Drop expired rows, then the oldest ones beyond max_entries."""
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        if count > self.max_entries:
+            # Every row gets the same TTL, so the earliest expiry is the oldest write
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY expires_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def _set(self, key: str, value: dict) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)",
+                (key, orjson.dumps(value).decode(), time.time() + self.ttl_seconds),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY_WRITES == 0:
+                self._prune()
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: dict) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+
+def embed(text: str) -> Dict[str, float]:
+    """Sparse, L2-normalized bag of words and character trigrams."""
+    words = WORD_RE.findall(text.casefold())
+    features = Counter(words)
+    for word in words:
+        padded = f" {word} "
+        features.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    norm = math.sqrt(sum(count * count for count in features.values())) or 1.0
+    return {feature: count / norm for feature, count in features.items()}
+
+
+def cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(feature, 0.0) for feature, weight in a.items())
+
+
+def _numbers(text: str) -> frozenset:
+    """Numbers (with unit letter) that a paraphrase must keep, e.g. 50k or 14."""
+    return frozenset(match.replace(" ", "") for match in NUMBER_RE.findall(text.casefold()))
+
+
+def _hash(payload: Any) -> str:
+    return hashlib.sha256(
+        orjson.dumps(payload, default=str, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
+
+
+def _serialize_response(response: BaseMessage) -> dict:
+    return {
+        "content": response.content,
+        "tool_calls": [
+            {"name": tool_call["name"], "args": tool_call["args"]}
+            for tool_call in getattr(response, "tool_calls", None) or []
+        ],
+    }
+
+
+def _deserialize_response(value: dict) -> AIMessage:
+    # Fresh ids so a replayed response never shares tool call ids with the original
+    return AIMessage(
+        content=value.get("content", ""),
+        tool_calls=[
+            {**tool_call, "id": str(uuid.uuid4())}
+            for tool_call in value.get("tool_calls", [])
+        ],
+    )
+
+
+class LLMCache:
+    """Exact-key cache backed by a CacheBackend, plus an in-memory semantic index."""
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        similarity: float = LLM_CACHE_SIMILARITY,
+        max_semantic_entries: int = LLM_CACHE_MAX_ENTRIES,
+    ):
+        self.backend = backend
+        self.similarity = similarity
+        self.max_semantic_entries = max_semantic_entries
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0}
+        # Recent queries per context: key -> (context hash, embedding, numbers)
+        self._semantic: "OrderedDict[str, Tuple[str, Dict[str, float], frozenset]]" = (
+            OrderedDict()
+        )
+        self._pending_writes = set()
+        # Calls still waiting on the LLM, so identical concurrent misses share one
+        self._in_flight: Dict[str, "asyncio.Task[BaseMessage]"] = {}
+
+    def _find_similar(self, context_key: str, query: str) -> Optional[str]:
+        vector = embed(query)
+        numbers = _numbers(query)
+        best_key, best_score = None, self.similarity
+        for key, (entry_context, entry_vector, entry_numbers) in self._semantic.items():
+            if entry_context != context_key or entry_numbers != numbers:
+                continue
+            score = cosine(vector, entry_vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    async def get(
+        self, context_key: str, query: str, semantic: bool = True
+    ) -> Tuple[str, Optional[AIMessage]]:
+        """Return the exact key for (context, query) and a cached response, if any.
+
+        With semantic=False only an exact match counts as a hit.
+        """
+        key = _hash({"ctx": context_key, "q": query})
+        value = await self.backend.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return key, _deserialize_response(value)
+
+        similar_key = self._find_similar(context_key, query) if semantic else None
+        if similar_key:
+            value = await self.backend.get(similar_key)
+            if value is not None:
+                self.stats["semantic_hits"] += 1
+                return key, _deserialize_response(value)
+            # The backend expired it, so stop matching against it
+            self._semantic.pop(similar_key, None)
+
+        self.stats["misses"] += 1
+        return key, None
+
+    def put(
+        self,
+        key: str,
+        context_key: str,
+        query: str,
+        response: BaseMessage,
+        semantic: bool = True,
+    ) -> None:
+        """Store a response without blocking the caller on the backend write."""
+        if semantic:
+            self._semantic[key] = (context_key, embed(query), _numbers(query))
+            self._semantic.move_to_end(key)
+            while len(self._semantic) > self.max_semantic_entries:
+                self._semantic.popitem(last=False)
+
+        task = asyncio.create_task(self._write(key, _serialize_response(response)))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    def join_in_flight(self, key: str) -> "Optional[asyncio.Task[BaseMessage]]":
+        return self._in_flight.get(key)
+
+    def start_in_flight(self, key: str, coro) -> "asyncio.Task[BaseMessage]":
+        """Run the LLM call as a task other requests for the same key can await."""
+        task = asyncio.create_task(coro)
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    async def _write(self, key: str, value: dict) -> None:
+        try:
+            await self.backend.set(key, value)
+        except Exception as e:
+            logger.warning("Failed to write LLM cache entry: %s", e)
+
+
+def create_llm_cache() -> LLMCache:
+    """Build the cache configured by LLM_CACHE_BACKEND (memory, redis or sqlite)."""
+    if LLM_CACHE_BACKEND == "redis":
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+        return LLMCache(RedisCacheBackend(redis_url, LLM_CACHE_TTL_SECONDS))
+    if LLM_CACHE_BACKEND == "sqlite":
+        return LLMCache(
+            SQLiteCacheBackend(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES)
+        )
+    return LLMCache(MemoryCacheBackend(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS))
+
+
+llm_cache = create_llm_cache()
+
+
+def context_key(system_prompt: str, history: Sequence[BaseMessage]) -> str:
+    """Hash of everything besides the query that the response depends on."""
+    return _hash({"sys": system_prompt, "hist": [m.content for m in history]})
+
+
+async def cached_invoke(
+    runnable,
+    messages: List[BaseMessage],
+    *,
+    system_prompt: str,
+    history: Sequence[BaseMessage],
+    query: str,
+    semantic: bool = True,
+    cache: LLMCache = llm_cache,
+) -> BaseMessage:
+    """Invoke the runnable unless a response for this context and query is cached.
+
+    Concurrent misses for the same key wait on a single LLM call instead of
+    each sending their own.
+
+    Only pass through prompt text that can change the answer: anything derived
+    from the query alone is already covered by the query itself.
+
+    Pass semantic=False when a near-identical query can need a different
+    answer, so only exact repeats are served from the cache.
+    """
+    context = context_key(system_prompt, history)
+    try:
+        key, cached = await cache.get(context, query, semantic)
+    except Exception as e:
+        logger.warning("LLM cache lookup failed: %s", e)
+        key, cached = None, None
+    if cached is not None:
+        logger.info("LLM response served from cache")
+        return cached
+
+    if not key:
+        return await runnable.ainvoke(messages)
+
+    task = cache.join_in_flight(key)
+    if task is not None:
+        logger.info("LLM response shared with an identical in-flight request")
+        # Shielded so one caller going away doesn't cancel the call for the rest
+        response = await asyncio.shield(task)
+        return _deserialize_response(_serialize_response(response))
+
+    task = cache.start_in_flight(key, runnable.ainvoke(messages))
+    response = await asyncio.shield(task)
+    # Empty responses are usually transient failures, so don't pin them
+    if response.content or getattr(response, "tool_calls", None):
+        cache.put(key, context, query, response, semantic)
+    return response
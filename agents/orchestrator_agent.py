@@ -1,10 +1,15 @@
+import asyncio
 import logging
-from typing import Literal, Sequence
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import AsyncIterator, Literal, Optional, Sequence
 from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
+from langchain_core.messages import AIMessageChunk, BaseMessage, SystemMessage, HumanMessage
 from llm import get_llm
-from state.state import State
-from agents.product_filter_agent import product_filter_node, query_executor_node
+from state.state import State, with_content
+from agents.product_filter_agent import product_filter_node
 from agents.summary_agent import summary_node
 from agents.store_analysis_agent import store_analysis_node
 from helpers.redis_helper import get_simple_chat_history
@@ -14,6 +19,9 @@ logger = logging.getLogger(__name__)
 
 llm = get_llm()
 
+# Upper bound on a single Redis round trip so a slow cache never stalls a request
+REDIS_TIMEOUT_SECONDS = float(os.getenv("REDIS_TIMEOUT_SECONDS", "2"))
+
 ROUTER_PROMPT_SHORT = (
     "Classify the user query for routing. Reply with ONLY one token:\n"
     "- product_filter_node  → product-related search/filter queries such as 'jewellery_type,' 'metal,' 'purity,' 'relationship,' 'occasion,' 'price,' etc. that need SQL over products\n"
@@ -21,47 +29,148 @@ ROUTER_PROMPT_SHORT = (
     "No extra words."
 )
 
+# Lexical routing rules; the LLM router is only consulted when these disagree
+STORE_RE = re.compile(
+    r"\b(stores?|asp|trends?|performance|performing|strateg(?:y|ies)|insights?|sales|revenue)\b",
+    re.IGNORECASE,
+)
+PRODUCT_RE = re.compile(
+    r"\b(rings?|earrings?|pendants?|necklaces?|bangles?|mangalsutras?|tanmaniya|rakhi"
+    r"|bracelets?|nose\s*pins?|kadas?|charms?|chains?|anklets?|brooch(?:es)?|cufflinks"
+    r"|coins?|watch(?:es)?|nath|jewell?e?ry|gold|silver|platinum|diamonds?|metal|purity"
+    r"|\d+\s*kt|karat|price|under|below|above|cheap(?:est)?|expensive|budget|gifts?"
+    r"|anniversary|diwali|christmas|dhanteras|valentines?|wedding|birthday|wife|husband"
+    r"|girlfriend|mother|father|sister|daughter|son|friend|grand(?:pa|ma|parents?)"
+    r"|show\s+more|load\s+more|next\s+page)\b",
+    re.IGNORECASE,
+)
+ROUTES = ("product_filter_node", "store_analysis_node")
+
+# The graph is acyclic and takes two steps; a tight cap stops any future loop early
+GRAPH_CONFIG = {"recursion_limit": int(os.getenv("GRAPH_RECURSION_LIMIT", "5"))}
+DEFAULT_ROUTE = "product_filter_node"
 
-def orchestrator(state: State):
-    logger.info("Orchestrator: Routing start")
-    return {
-        "chat_history": state.get("chat_history", []),
-        "query": state.get("query", ""),
-    }
+# Store analysis is still a placeholder, so asking the LLM to break keyword
+# ties costs a round trip for little gain; opt in once it does real work
+ROUTER_LLM_FALLBACK = os.getenv("ROUTER_LLM_FALLBACK", "false").lower() == "true"
+
+# LLM decisions for queries the keyword rules could not settle, in LRU order
+ROUTE_CACHE_SIZE = 4096
+_llm_route_cache: "OrderedDict[str, str]" = OrderedDict()
 
 
 def get_chat_history(user_email: str):
     return get_simple_chat_history(user_email)
 
 
-def save_chat_history(user_email: str, chat_history: Sequence[BaseMessage]):
+async def save_chat_history(
+    user_email: str,
+    chat_history: Sequence[BaseMessage],
+    last_sql: Optional[dict] = None,
+):
     history = get_chat_history(user_email)
-    history.add_messages(chat_history)
+    try:
+        await asyncio.wait_for(
+            history.add_messages(list(chat_history), last_sql), REDIS_TIMEOUT_SECONDS
+        )
+        logger.info("Saved %d messages to Redis", len(chat_history))
+    except Exception as redis_error:
+        logger.warning("Failed to save to Redis: %s", redis_error)
+
+
+# In-flight saves per session; also keeps the tasks from being garbage collected
+_pending_saves = {}
+
+
+def schedule_save_chat_history(
+    user_email: str,
+    chat_history: Sequence[BaseMessage],
+    last_sql: Optional[dict] = None,
+):
+    """Persist the turn without making the response wait for the Redis ack."""
+    task = asyncio.create_task(save_chat_history(user_email, chat_history, last_sql))
+    _pending_saves[user_email] = task
 
+    def _forget(done: asyncio.Task):
+        if _pending_saves.get(user_email) is done:
+            del _pending_saves[user_email]
 
-def route_via_llm(
+    task.add_done_callback(_forget)
+
+
+async def flush_pending_saves():
+    """Wait for every in-flight save, e.g. before the worker shuts down."""
+    if _pending_saves:
+        await asyncio.wait(set(_pending_saves.values()), timeout=REDIS_TIMEOUT_SECONDS)
+
+
+async def wait_for_pending_save(user_email: str):
+    """Make sure the previous turn of this session is stored before reading it."""
+    task = _pending_saves.get(user_email)
+    if task is not None:
+        await asyncio.wait({task}, timeout=REDIS_TIMEOUT_SECONDS)
+
+
+@lru_cache(maxsize=1024)
+def classify_query(query: str) -> Optional[str]:
+    """Route a query lexically; returns None when the keywords are ambiguous."""
+    is_store = STORE_RE.search(query) is not None
+    is_product = PRODUCT_RE.search(query) is not None
+    if is_store and not is_product:
+        return "store_analysis_node"
+    if is_product and not is_store:
+        return "product_filter_node"
+    return None
+
+
+async def route_via_llm(
     state: State,
 ) -> Literal["product_filter_node", "store_analysis_node"]:
+    # Already decided before the graph was entered
+    if state.get("selected_agent") in ROUTES:
+        return state["selected_agent"]
+
     query = (state.get("query") or "").strip()
+    normalized_query = " ".join(query.casefold().split())
+    decision = classify_query(normalized_query)
+    if decision:
+        logger.info("Decision (keyword): %s", decision)
+        return decision
+
+    if not ROUTER_LLM_FALLBACK:
+        logger.info("Decision (default): %s", DEFAULT_ROUTE)
+        return DEFAULT_ROUTE
+
+    decision = _llm_route_cache.get(normalized_query)
+    if decision:
+        _llm_route_cache.move_to_end(normalized_query)
+        logger.info("Decision (cached): %s", decision)
+        return decision
+
     messages = [SystemMessage(content=ROUTER_PROMPT_SHORT), HumanMessage(content=query)]
-    response = llm.invoke(messages)
-    logger.info(f"Decision: {response.content}")
+    response = await llm.ainvoke(messages)
+    logger.info("Decision: %s", response.content)
     decision = (response.content or "").strip().lower()
+    if decision not in ROUTES:
+        logger.warning("Unexpected routing decision %r, using product filter", decision)
+        return DEFAULT_ROUTE
+
+    _llm_route_cache[normalized_query] = decision
+    if len(_llm_route_cache) > ROUTE_CACHE_SIZE:
+        _llm_route_cache.popitem(last=False)
     return decision
 
 
 def create_orchestrator_graph():
     builder = StateGraph(State)
 
-    builder.add_node("orchestrator", orchestrator)
     builder.add_node("product_filter_node", product_filter_node)
-    builder.add_node("query_executor_node", query_executor_node)
     builder.add_node("summary_node", summary_node)
     builder.add_node("store_analysis_node", store_analysis_node)
 
-    builder.add_edge(START, "orchestrator")
+    # Route straight from START; a pass-through node would only add a super-step
     builder.add_conditional_edges(
-        "orchestrator",
+        START,
         route_via_llm,
         {
             "product_filter_node": "product_filter_node",
@@ -69,8 +178,7 @@ def create_orchestrator_graph():
         },
     )
 
-    builder.add_edge("product_filter_node", "query_executor_node")
-    builder.add_edge("query_executor_node", "summary_node")
+    builder.add_edge("product_filter_node", "summary_node")
     builder.add_edge("summary_node", END)
     builder.add_edge("store_analysis_node", END)
 
@@ -80,46 +188,113 @@ def create_orchestrator_graph():
 orchestrator_graph = create_orchestrator_graph()
 
 
-def invoke_orchestrator(query: str, user_email: str) -> dict:
+async def load_initial_state(query: str, user_email: str) -> dict:
+    """Build the graph input for a turn from the user's stored chat history."""
+    # Re-enable Redis with proper error handling
+    try:
+        await wait_for_pending_save(user_email)
+        past_messages, last_sql = await asyncio.wait_for(
+            get_chat_history(user_email).load(), REDIS_TIMEOUT_SECONDS
+        )
+        logger.info("Retrieved %d messages from Redis", len(past_messages))
+        # Drop empty messages once here so the nodes need no per-turn filtering
+        past_messages = with_content(*past_messages)
+    except Exception as redis_error:
+        logger.warning("Redis error, using empty chat history: %s", redis_error)
+        past_messages = []
+        last_sql = None
+
+    return {
+        "query": query,
+        "chat_history": past_messages,
+        "response": None,
+        "cart": [],
+        "store_code": None,
+        "last_sql": last_sql,
+        "sql_result": None,
+    }
+
+
+async def run_store_analysis(state: dict) -> dict:
+    """Run the single store analysis node directly and merge its update.
+
+    The route has no further steps, so the graph runtime would only add
+    scheduling and state-merging overhead.
+    """
+    update = await store_analysis_node(state)
+    return {
+        **state,
+        **update,
+        "chat_history": [*state["chat_history"], *update.get("chat_history", [])],
+    }
+
+
+async def invoke_orchestrator(query: str, user_email: str) -> dict:
     try:
-        # Re-enable Redis with proper error handling
-        try:
-            chat_history = get_chat_history(user_email)
-            past_messages = chat_history.get_messages()
-            logger.info(f"Retrieved {len(past_messages)} messages from Redis")
-
-            # If we have too many messages (indicating potential issues), clear cache
-            if len(past_messages) > 100:
-                logger.warning("Too many messages in cache, clearing for fresh start")
-                chat_history.clear()
-                past_messages = []
-        except Exception as redis_error:
-            logger.warning(f"Redis error, using empty chat history: {redis_error}")
-            past_messages = []
-
-        initial_state = {
-            "query": query,
-            "chat_history": past_messages,
-            "response": None,
-            "cart": [],
-            "store_code": None,
-        }
-        result = orchestrator_graph.invoke(initial_state)
-
-        # Save to Redis with error handling
-        try:
-            save_chat_history(user_email, result.get("chat_history", []))
-            logger.info(
-                f"Saved {len(result.get('chat_history', []))} messages to Redis"
-            )
-        except Exception as redis_error:
-            logger.warning(f"Failed to save to Redis: {redis_error}")
+        initial_state = await load_initial_state(query, user_email)
+        history_length = len(initial_state["chat_history"])
+        initial_state["selected_agent"] = await route_via_llm(initial_state)
+        if initial_state["selected_agent"] == "store_analysis_node":
+            result = await run_store_analysis(initial_state)
+        else:
+            result = await orchestrator_graph.ainvoke(initial_state, config=GRAPH_CONFIG)
+
+        # Persist only this turn's messages; the loaded history is already stored
+        new_messages = result.get("chat_history", [])[history_length:]
+        schedule_save_chat_history(user_email, new_messages, result.get("last_sql"))
 
         logger.info("Orchestrator completed successfully")
         return result
     except Exception as e:
-        logger.error(f"Error in orchestrator: {e}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception("Error in orchestrator: %s", e)
         return {"error": str(e), "chat_history": [], "query": query}
+
+
+async def stream_orchestrator(query: str, user_email: str) -> AsyncIterator[dict]:
+    """Run the graph and yield events as soon as they are available.
+
+    Yields ``{"node": name, "update": update}`` after each node finishes and
+    ``{"token": text}`` for every summary chunk the LLM streams, or a single
+    ``{"error": message}`` if the run fails. Summaries served from the LLM
+    cache or shared with an in-flight request are not streamed; they arrive
+    whole in the summary node's update.
+    """
+    try:
+        initial_state = await load_initial_state(query, user_email)
+        new_messages = []
+        last_sql = initial_state["last_sql"]
+
+        initial_state["selected_agent"] = await route_via_llm(initial_state)
+        if initial_state["selected_agent"] == "store_analysis_node":
+            update = await store_analysis_node(initial_state)
+            yield {"node": "store_analysis_node", "update": update}
+            schedule_save_chat_history(user_email, update.get("chat_history", []), last_sql)
+            return
+
+        async for mode, chunk in orchestrator_graph.astream(
+            initial_state, config=GRAPH_CONFIG, stream_mode=["updates", "messages"]
+        ):
+            if mode == "messages":
+                message, metadata = chunk
+                # Only the summary is user-facing text; SQL generation stays internal.
+                # Whole messages are replays of a finished answer, not tokens
+                if (
+                    metadata.get("langgraph_node") == "summary_node"
+                    and isinstance(message, AIMessageChunk)
+                    and message.content
+                ):
+                    yield {"token": message.content}
+                continue
+
+            for node, update in chunk.items():
+                if not update:
+                    continue
+                new_messages.extend(update.get("chat_history", []))
+                last_sql = update.get("last_sql", last_sql)
+                yield {"node": node, "update": update}
+
+        schedule_save_chat_history(user_email, new_messages, last_sql)
+        logger.info("Orchestrator stream completed successfully")
+    except Exception as e:
+        logger.exception("Error in orchestrator stream: %s", e)
+        yield {"error": str(e)}
@@ -1,9 +1,28 @@
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+from itertools import islice
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import orjson
+import sqlglot
+from sqlglot import exp
 from llm import get_llm
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, HumanMessage
 from langchain_core.tools import tool
-from state.state import State
-from helpers.db_helper import get_db_connection
+from state.state import State, with_content
+from helpers.db_helper import DB_POOL_SIZE, get_db_connection
+from agents.llm_cache import cached_invoke, cosine, embed
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,273 +30,819 @@ logger = logging.getLogger(__name__)
 
 llm = get_llm()
 
+# Rows returned when neither the SQL nor the request asks for a number
+DEFAULT_RESULT_LIMIT = 10
 
-@tool
-def execute_sql_query(query: str) -> str:
-    """Execute a SQL query on the product table (SELECT, DESCRIBE, SHOW only for safety)."""
-    query_upper = query.strip().upper()
+# Natural-language result counts such as "top 5", "show 10", "limit 20"
+# or "5 results", matched in a single scan
+LIMIT_PATTERN = re.compile(
+    r"(?:top|show|limit)\s+(\d+)|(\d+)\s+(?:results?|items?|products?)"
+)
+
+
+@lru_cache(maxsize=512)
+def parse_sql(query: str) -> Optional[exp.Expression]:
+    """Parse a MySQL statement once; pagination re-submits the same query text.
+
+    The returned tree is shared between callers and must not be mutated.
+    """
+    try:
+        # sqlglot understands "?" but not the driver's "%s" placeholder style
+        return sqlglot.parse_one(query.replace("%s", "?"), read="mysql")
+    except sqlglot.errors.SqlglotError:
+        return None
+
+
+def get_sql_limit(query: str) -> Optional[int]:
+    """Return the row count of the statement's top-level LIMIT clause, if any."""
+    tree = parse_sql(query)
+    if tree is None:
+        return None
+    limit = tree.args.get("limit")
+    value = limit.expression if limit is not None else None
+    if isinstance(value, exp.Literal) and value.is_int:
+        return int(value.this)
+    return None
+
+
+# Read-only statement check: an anchored match on the statement type, then a
+# write keyword scan over the raw text for every statement, SELECTs included
+ALLOWED_SQL_RE = re.compile(r"^\s*(SELECT|DESCRIBE|SHOW)\b", re.IGNORECASE)
+FORBIDDEN_SQL_RE = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|OUTFILE|DUMPFILE)\b",
+    re.IGNORECASE,
+)
+
+# Fixed messages for results that never reach the database
+ERROR_MESSAGES = {
+    "not_allowed": "Error: Only SELECT, DESCRIBE, and SHOW queries are allowed for security reasons.",
+    "forbidden": "Error: Query contains forbidden keywords. Only SELECT, DESCRIBE, and SHOW queries are allowed.",
+    "comment": "Error: Block comments are not allowed in queries.",
+    "no_connection": "Unable to connect to database",
+    "unparsable": "Error: Query could not be parsed as a single read-only SELECT statement.",
+}
+
+
+# Nodes that make a parsed SELECT write data, run other statements or take locks
+WRITE_NODES = (
+    exp.Insert,
+    exp.Update,
+    exp.Delete,
+    exp.Drop,
+    exp.Create,
+    exp.Alter,
+    exp.Into,
+    exp.Command,
+)
+
+
+def sql_rejection(query: str, statement: str) -> Optional[str]:
+    """Return the error key for a disallowed query, or None if it may run.
+
+    Every statement gets the keyword scan over its raw text. SELECTs are then
+    also checked on the parsed tree, which rejects stacked statements,
+    SELECT ... INTO and locking reads.
+    """
+    # MySQL runs /*! ... */ as SQL while sqlglot drops it as a comment, so a
+    # block comment could hide a statement from the parsed-tree check
+    if "/*" in query:
+        return "comment"
+    # Independent of sqlglot, in case it reads the text differently than MySQL
+    if FORBIDDEN_SQL_RE.search(query):
+        return "forbidden"
+    if statement != "SELECT":
+        return None
+
+    tree = parse_sql(query)
+    if tree is None or not isinstance(tree, exp.Query):
+        return "unparsable"
+    if tree.args.get("locks") or tree.find(*WRITE_NODES):
+        return "forbidden"
+    return None
+
+
+def _json_default(value: Any) -> Any:
+    """Encode MySQL column types that orjson does not serialize natively."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+JSON_NATIVE_TYPES = (str, int, float, bool, type(None))
+
+
+def json_row(columns: Sequence[str], row: Sequence[Any]) -> Dict[str, Any]:
+    """Build a result row whose values any JSON encoder can handle as-is."""
+    return {
+        column: value if isinstance(value, JSON_NATIVE_TYPES) else _json_default(value)
+        for column, value in zip(columns, row)
+    }
+
+
+def dump_result(payload: dict) -> str:
+    """Serialize a tool result payload to a JSON string."""
+    return orjson.dumps(payload, default=_json_default).decode()
+
+
+def error_result(query: str, message: str) -> dict:
+    """Build an empty result payload carrying an error message."""
+    return {"count": 0, "results": [], "query": query, "message": message}
+
+
+# Catalog data changes rarely, so identical SQL can be answered from memory briefly
+SQL_RESULT_CACHE_TTL_SECONDS = int(os.getenv("SQL_RESULT_CACHE_TTL_SECONDS", "120"))
+SQL_RESULT_CACHE_SIZE = int(os.getenv("SQL_RESULT_CACHE_SIZE", "512"))
+# Large results would crowd out many small ones, so they are not cached at all
+SQL_RESULT_CACHE_MAX_ROWS = int(os.getenv("SQL_RESULT_CACHE_MAX_ROWS", "200"))
+# DESCRIBE and SHOW only change with a migration, so they are kept much longer
+SCHEMA_CACHE_TTL_SECONDS = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", "600"))
+
+# Tool calls run in worker threads, so the cache is guarded by a lock
+_result_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+
+def result_cache_key(query: str, params: Optional[List[str]]) -> str:
+    """Hash the canonical SQL text together with its bound parameters."""
+    tree = parse_sql(query)
+    canonical = tree.sql(dialect="mysql") if tree is not None else " ".join(query.split())
+    return hashlib.sha256(orjson.dumps([canonical, params or []])).hexdigest()
+
+
+def get_cached_result(key: str) -> Optional[dict]:
+    with _result_cache_lock:
+        entry = _result_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at < time.monotonic():
+            del _result_cache[key]
+            return None
+        _result_cache.move_to_end(key)
+        return payload
+
+
+def cache_result(
+    key: str, payload: dict, ttl_seconds: int = SQL_RESULT_CACHE_TTL_SECONDS
+) -> None:
+    if payload["count"] > SQL_RESULT_CACHE_MAX_ROWS:
+        return
+    with _result_cache_lock:
+        _result_cache[key] = (time.monotonic() + ttl_seconds, payload)
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > SQL_RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+
+def clear_sql_result_cache() -> int:
+    """Drop every cached query result and return how many were removed.
+
+    The schema message in the SQL prompt is dropped too, so a migration shows
+    up on the next request.
+    """
+    global _schema_message, _schema_refresh_at
+    with _result_cache_lock:
+        removed = len(_result_cache)
+        _result_cache.clear()
+    _schema_message, _schema_refresh_at = None, 0.0
+    return removed
+
+
+def resolve_result_limit(query: str, query_folded: str) -> Tuple[int, bool]:
+    """Return how many rows to show and whether the SQL sets its own LIMIT."""
+    # First, check if the SQL query itself has a LIMIT clause
+    sql_limit = get_sql_limit(query) if "limit" in query_folded else None
+    if sql_limit is not None:
+        # If SQL has LIMIT, respect it and show all results up to that limit
+        return sql_limit, True
+
+    # Check if user asked for specific number of results in natural language
+    if "top" in query_folded or "show" in query_folded or "limit" in query_folded:
+        # User might have asked for "top 5", "show 3", "limit 15", etc.
+        match = LIMIT_PATTERN.search(query_folded)
+        if match:
+            return int(match.group(1) or match.group(2)), False
 
+    # Default to 10 results for readability
+    return DEFAULT_RESULT_LIMIT, False
+
+
+def run_sql_query(query: str, params: Optional[List[str]] = None) -> dict:
+    """Run a read-only SQL query and return the result payload as a dict."""
     # Security check - allow SELECT, DESCRIBE, and SHOW queries
-    allowed_prefixes = ["SELECT", "DESCRIBE", "SHOW"]
-    if not any(query_upper.startswith(prefix) for prefix in allowed_prefixes):
-        return str(
-            {
-                "count": 0,
-                "results": [],
-                "query": query,
-                "message": "Error: Only SELECT, DESCRIBE, and SHOW queries are allowed for security reasons.",
-            }
-        )
+    allowed = ALLOWED_SQL_RE.match(query)
+    if not allowed:
+        return error_result(query, ERROR_MESSAGES["not_allowed"])
 
     # Additional security checks for dangerous operations
-    forbidden_keywords = [
-        "INSERT",
-        "UPDATE",
-        "DELETE",
-        "DROP",
-        "CREATE",
-        "ALTER",
-        "TRUNCATE",
-    ]
-    if any(keyword in query_upper for keyword in forbidden_keywords):
-        return str(
-            {
-                "count": 0,
-                "results": [],
-                "query": query,
-                "message": "Error: Query contains forbidden keywords. Only SELECT, DESCRIBE, and SHOW queries are allowed.",
-            }
-        )
+    statement = allowed.group(1).upper()
+    rejection = sql_rejection(query, statement)
+    if rejection:
+        return error_result(query, ERROR_MESSAGES[rejection])
+
+    # Identical SQL and params within the TTL skip the database entirely
+    cache_key = result_cache_key(query, params)
+    cached = get_cached_result(cache_key)
+    if cached is not None:
+        return {**cached, "cache_hit": True}
+
+    query_folded = query.casefold()
+
+    # Determine result limit based on user request before touching the database
+    result_limit, has_sql_limit = resolve_result_limit(query, query_folded)
+
+    # Without a LIMIT of its own, cap the SELECT on the server and fetch one extra
+    # row to learn whether more results exist, instead of pulling the whole table
+    executed_query = query
+    if not has_sql_limit and statement == "SELECT":
+        executed_query = f"{query.rstrip().rstrip(';')}\nLIMIT {result_limit + 1}"
 
     try:
         # Connect to the database using the existing function
         conn = get_db_connection()
         if not conn:
-            import json
-
-            return json.dumps(
-                {
-                    "count": 0,
-                    "results": [],
-                    "query": query,
-                    "message": "Unable to connect to database",
-                }
-            )
-
-        cursor = conn.cursor(dictionary=True)
+            return error_result(query, ERROR_MESSAGES["no_connection"])
 
-        # Execute the query
-        cursor.execute(query)
+        # Closing hands the connection back to the pool, even when the query fails.
+        # Params are escaped by the driver, so the query is a single round trip
+        with closing(conn), closing(conn.cursor()) as cursor:
+            if params:
+                cursor.execute(executed_query, tuple(params))
+            else:
+                cursor.execute(executed_query)
 
-        # Fetch results
-        results = cursor.fetchall()
+            # Fetch plain tuples; dicts are built only for the rows we return
+            rows = cursor.fetchall()
+            columns = cursor.column_names
 
-        # Close connection
-        cursor.close()
-        conn.close()
+        # Schema listings are small and only useful whole, so only SELECTs are paged
+        if statement != "SELECT":
+            result_limit = len(rows)
 
         # Format results
-        if results:
-            # Count total results
+        if rows:
+            has_more = len(rows) > result_limit
+            # Converted once here so API responses serialize without a fallback encoder
+            results = [json_row(columns, row) for row in rows[:result_limit]]
             count = len(results)
-
-            # Determine result limit based on user request
-            # Default to 10 results for readability, but check if user asked for specific number
-            result_limit = 10
-
-            # First, check if the SQL query itself has a LIMIT clause
-            if "LIMIT" in query_upper:
-                try:
-                    # Find LIMIT clause and extract number
-                    limit_match = query_upper.split("LIMIT")[-1].strip().split()[0]
-                    if limit_match.isdigit():
-                        # If SQL has LIMIT, respect it and show all results up to that limit
-                        result_limit = int(limit_match)
-                except:  # noqa: E722
-                    pass
-            else:
-                # Check if user asked for specific number of results in natural language
-                user_query = query.lower()
-                if "top" in user_query or "show" in user_query or "limit" in user_query:
-                    # User might have asked for "top 5", "show 3", "limit 15", etc.
-                    import re
-
-                    # Look for patterns like "top 5", "show 10", "limit 20"
-                    patterns = [
-                        r"top\s+(\d+)",
-                        r"show\s+(\d+)",
-                        r"limit\s+(\d+)",
-                        r"(\d+)\s+results?",
-                        r"(\d+)\s+items?",
-                        r"(\d+)\s+products?",
-                    ]
-
-                    for pattern in patterns:
-                        match = re.search(pattern, user_query)
-                        if match:
-                            requested_count = int(match.group(1))
-                            result_limit = min(requested_count, count)
-                            break
+            more_note = " More results are available." if has_more else ""
 
             # Format the response
             response = {
-                "count": count,  # Total available results
-                "results": results[:result_limit],  # Show limited results
+                "count": count,  # Results returned in this page
+                "results": results,
                 "query": query,
-                "message": f"Query executed successfully. Found {count} total results. Showing {min(result_limit, count)} results.",
-                "total_available": count,  # Total count available
-                "showing": min(result_limit, count),  # How many we're showing
-                "has_more": count
-                > result_limit,  # Flag indicating if there are more results
+                "params": params or [],
+                "message": f"Query executed successfully. Showing {count} results.{more_note}",
+                "showing": count,  # How many we're showing
+                "has_more": has_more,  # Flag indicating if there are more results
             }
-
-            import json
-
-            return json.dumps(response)
         else:
-            import json
-
-            return json.dumps(
-                {
-                    "count": 0,
-                    "results": [],
-                    "query": query,
-                    "message": "Query executed successfully. No results found.",
-                }
-            )
-
-    except Exception as e:
-        logger.error(f"Database error: {e}")
-        import json
-
-        return json.dumps(
-            {
+            response = {
                 "count": 0,
                 "results": [],
                 "query": query,
-                "message": f"Error executing query: {str(e)}",
+                "params": params or [],
+                "message": "Query executed successfully. No results found.",
             }
-        )
-
-
-# List of available tools
-tools = [execute_sql_query]
 
-# Bind tools to LLM
-llm_with_tools = llm.bind_tools(tools)
-
-
-def product_filter_node(state: State):
-    """Call the LLM to generate SQL queries based on user input."""
-    try:
-        chat_history = state.get("chat_history", [])
-        query = state.get("query", "")
+        cache_result(
+            cache_key,
+            response,
+            SQL_RESULT_CACHE_TTL_SECONDS if statement == "SELECT" else SCHEMA_CACHE_TTL_SECONDS,
+        )
+        return {**response, "cache_hit": False}
 
-        # Create system prompt for SQL generation
-        system_prompt = """You are a SQL expert for CaratLane's product database.
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        return error_result(query, f"Error executing query: {str(e)}")
 
-        Your task is to generate SQL queries based on user requests for product information.
 
-        Available tables:
-        - product: Contains product details like sku, price, metal, purity, jewellery_type, etc.
+@tool
+def execute_sql_query(query: str, params: Optional[List[str]] = None) -> str:
+    """Execute a SQL query on the product table (SELECT, DESCRIBE, SHOW only for safety).
 
-        EXACT COLUMN VALUES - USE THESE EXACTLY:
+    Filter values should be passed in ``params`` and referenced with ``%s``
+    placeholders in ``query``, in the same order.
+    """
+    return dump_result(run_sql_query(query, params))
 
-        jewellery_type: Rings, Earrings, Pendants, Necklaces, Bangles, Mangalsutra, Tanmaniya, Silver Rakhi, Bracelets, Nose pin, Mount-Rings, Mount-Earrings, Mount-Pendants, Kada, Charms, Chains, Toe Rings, Anklets, Set Product, Nose Accessories, Silver Articles, Adjustable Rings, Hair Accessories, CuffLinks, Brooch, Brooches, Sets, Watch Charms, Nacklace, Silver Coin, Gold Coin, Baby Bangles, Wrist Watches, Arm Bands, Waist Bands, Earring, Dummy Product, Kanoti, Hasli Necklaces, Kurta Buttons, Bracelet, Charm Builders, Nath
 
-        metal: 14 KT White, 18 KT Yellow, 18 KT White, 14 KT Two Tone, 14 KT Yellow, 18 KT Two Tone, 14 KT Rose, Silver 925 Silver, 18 KT Rose, Platinum 950 Platinum, 22 KT Yellow, Platinum 950 White, 14 KT, 18 KT Three Tone, Brass Silver, Platinum 950 18 KT Two Tone, 14 KT Three Tone, 18 KT, 9 KT Yellow, 14 KT S925 Yellow, 10 KT Yellow, Silver 925 Yellow, Silver 999 Silver, Silver 925 White, Platinum 950 Two Tone, 22 KT Two Tone, 24 KT Yellow, Silver 925 Rose, 10 KT Rose, Platinum 950 18 KT Three Tone, 22 KT White, 9 KT Rose, Platinum 950 18 KT Two Tone Platinum Rose, 14 KT S925 White, 18 KT S925 White, 18 KT S925 Rose, 18 KT S925 Yellow, 10 KT White, 9 KT White
+# One worker per pooled connection: more threads would only hit an exhausted pool,
+# and a shared default executor would let other blocking work starve the queries
+sql_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sql")
 
-        purity: 14 KT, 18 KT, Silver 925, Platinum 950, 22 KT, Brass, Platinum 950 18 KT, 9 KT, 14 KT S925, 10 KT, Silver 999, 24 KT, 18 KT S925
+# List of available tools
+tools = [execute_sql_query]
 
-        relationship: Grandparent, Wife, Girlfriend, Husband, Sister, Others, Daughter, Son, Father, Niece/Nephew, Mother, Friend, Self
+# Bind tools to LLM
+llm_with_tools = llm.bind_tools(tools)
 
-        occasion: anniversary, diwali, christmas, dhanteras, valentines_day, mothers_day, general_gifting, akshaya_tritiya, wedding_season, raksha_bandhan, karva_chauth, ganesh_chaturthi, fathers_day, navratri, new_year
 
-        USER QUERY MAPPING EXAMPLES:
-        - "ring for my grandpa" → jewellery_type = "Rings" AND relationship = "Grandparent"
-        - "earrings for wife" → jewellery_type = "Earrings" AND relationship = "Wife"
-        - "14 KT white gold" → metal = "14 KT White"
-        - "anniversary gift" → occasion = "anniversary"
-        - "under 50k" → price < 50000
-        - "silver vs gold options" → metal IN ('Silver 925', '14 KT White', '18 KT Yellow', '18 KT White', '14 KT Rose', '18 KT Rose')
+SYSTEM_PROMPT = """You are a SQL expert for CaratLane's product database.
+
+Your task is to generate SQL queries based on user requests for product information.
+
+Available tables:
+- product: Contains product details like sku, price, metal, purity, jewellery_type, etc.
+
+EXACT COLUMN VALUES:
+- Use only the values listed under "RELEVANT COLUMN VALUES" for this request, spelled exactly as given
+- Columns: jewellery_type, metal, purity, relationship, occasion
+
+USER QUERY MAPPING EXAMPLES:
+- "ring for my grandpa" → jewellery_type = "Rings" AND relationship = "Grandparent"
+- "earrings for wife" → jewellery_type = "Earrings" AND relationship = "Wife"
+- "14 KT white gold" → metal = "14 KT White"
+- "anniversary gift" → occasion = "anniversary"
+- "under 50k" → price < 50000
+- "silver vs gold options" → metal IN ('Silver 925', '14 KT White', '18 KT Yellow', '18 KT White', '14 KT Rose', '18 KT Rose')
+
+Query Parameters:
+- Never inline filter values into the SQL text; use %s placeholders and pass the values in the 'params' argument, in order
+- Keep LIMIT and OFFSET as literal numbers in the SQL text
+- Example: "rings for wife under 50k" → query: "SELECT * FROM product WHERE jewellery_type = %s AND relationship = %s AND price < %s LIMIT 10", params: ["Rings", "Wife", "50000"]
+
+Guidelines:
+- Use 'jewellery_type' NOT 'category' for product types
+- Use 'sku' instead of 'name' or 'id' for product identification
+- Generate valid SQL queries using the EXACT column values provided
+- Use appropriate WHERE clauses for filtering
+- Return results in a readable format
+- Focus on product search and filtering queries
+
+Result Handling:
+- By default, show 10 results for better readability
+- If user asks for specific number (e.g., "top 5", "show 3"), add LIMIT clause
+- For comparison queries (e.g., "silver vs gold", "compare options"), use LIMIT 20-50 to show variety
+- For broad category searches, consider LIMIT 15-25 for better representation
+- Always return total count along with limited results
+- Use ORDER BY price ASC/DESC when appropriate for price-based queries
+- For expensive items, consider ORDER BY price DESC
+- For budget items, consider ORDER BY price ASC
+
+Pagination Logic:
+- If user asks "show more", "load more", "next page", or similar pagination requests:
+  1. Go through the chat history and find the LAST executed SQL query that contains a LIMIT clause
+  2. Extract the LIMIT value from that query
+  3. Check if the query already has an OFFSET clause:
+     - If NO OFFSET: Add OFFSET with value equal to the LIMIT value
+     - If OFFSET exists: Add the LIMIT value to the existing OFFSET value
+  4. Execute the modified query with the new OFFSET
+- Example: If last query was "SELECT * FROM product LIMIT 10", the next query should be "SELECT * FROM product LIMIT 10 OFFSET 10"
+- Example: If last query was "SELECT * FROM product LIMIT 10 OFFSET 20", the next query should be "SELECT * FROM product LIMIT 10 OFFSET 30"
+
+Examples:
+- "Show me top 5 expensive rings" → SELECT ... ORDER BY price DESC LIMIT 5
+- "Show me 3 cheapest earrings" → SELECT ... ORDER BY price ASC LIMIT 3
+- "Show me rings under 50k" → SELECT ... LIMIT 10 (default)
+- "Compare silver vs gold options" → SELECT ... LIMIT 25 (for variety)
+- "Show me budget options" → SELECT ... LIMIT 20 (for comparison)
+
+Always use the execute_sql_query tool to run your SQL queries."""
+
+# Allowed values per filter column, most common first
+COLUMN_VALUES = {
+    "jewellery_type": (
+        "Rings",
+        "Earrings",
+        "Pendants",
+        "Necklaces",
+        "Bangles",
+        "Mangalsutra",
+        "Tanmaniya",
+        "Silver Rakhi",
+        "Bracelets",
+        "Nose pin",
+        "Mount-Rings",
+        "Mount-Earrings",
+        "Mount-Pendants",
+        "Kada",
+        "Charms",
+        "Chains",
+        "Toe Rings",
+        "Anklets",
+        "Set Product",
+        "Nose Accessories",
+        "Silver Articles",
+        "Adjustable Rings",
+        "Hair Accessories",
+        "CuffLinks",
+        "Brooch",
+        "Brooches",
+        "Sets",
+        "Watch Charms",
+        "Nacklace",
+        "Silver Coin",
+        "Gold Coin",
+        "Baby Bangles",
+        "Wrist Watches",
+        "Arm Bands",
+        "Waist Bands",
+        "Earring",
+        "Dummy Product",
+        "Kanoti",
+        "Hasli Necklaces",
+        "Kurta Buttons",
+        "Bracelet",
+        "Charm Builders",
+        "Nath",
+    ),
+    "metal": (
+        "14 KT White",
+        "18 KT Yellow",
+        "18 KT White",
+        "14 KT Two Tone",
+        "14 KT Yellow",
+        "18 KT Two Tone",
+        "14 KT Rose",
+        "Silver 925 Silver",
+        "18 KT Rose",
+        "Platinum 950 Platinum",
+        "22 KT Yellow",
+        "Platinum 950 White",
+        "14 KT",
+        "18 KT Three Tone",
+        "Brass Silver",
+        "Platinum 950 18 KT Two Tone",
+        "14 KT Three Tone",
+        "18 KT",
+        "9 KT Yellow",
+        "14 KT S925 Yellow",
+        "10 KT Yellow",
+        "Silver 925 Yellow",
+        "Silver 999 Silver",
+        "Silver 925 White",
+        "Platinum 950 Two Tone",
+        "22 KT Two Tone",
+        "24 KT Yellow",
+        "Silver 925 Rose",
+        "10 KT Rose",
+        "Platinum 950 18 KT Three Tone",
+        "22 KT White",
+        "9 KT Rose",
+        "Platinum 950 18 KT Two Tone Platinum Rose",
+        "14 KT S925 White",
+        "18 KT S925 White",
+        "18 KT S925 Rose",
+        "18 KT S925 Yellow",
+        "10 KT White",
+        "9 KT White",
+    ),
+    "purity": (
+        "14 KT",
+        "18 KT",
+        "Silver 925",
+        "Platinum 950",
+        "22 KT",
+        "Brass",
+        "Platinum 950 18 KT",
+        "9 KT",
+        "14 KT S925",
+        "10 KT",
+        "Silver 999",
+        "24 KT",
+        "18 KT S925",
+    ),
+    "relationship": (
+        "Grandparent",
+        "Wife",
+        "Girlfriend",
+        "Husband",
+        "Sister",
+        "Others",
+        "Daughter",
+        "Son",
+        "Father",
+        "Niece/Nephew",
+        "Mother",
+        "Friend",
+        "Self",
+    ),
+    "occasion": (
+        "anniversary",
+        "diwali",
+        "christmas",
+        "dhanteras",
+        "valentines_day",
+        "mothers_day",
+        "general_gifting",
+        "akshaya_tritiya",
+        "wedding_season",
+        "raksha_bandhan",
+        "karva_chauth",
+        "ganesh_chaturthi",
+        "fathers_day",
+        "navratri",
+        "new_year",
+    ),
+}
+
+# Colloquial words mapped onto the tokens the column values actually use
+VALUE_ALIASES = {
+    "gold": "kt",
+    "karat": "kt",
+    "carat": "kt",
+    "mom": "mother",
+    "mum": "mother",
+    "dad": "father",
+    "grandpa": "grandparent",
+    "grandma": "grandparent",
+    "sis": "sister",
+    "myself": "self",
+    "bday": "general_gifting",
+    "birthday": "general_gifting",
+    "gift": "gifting",
+}
+
+# How many values per column are sent to the LLM for a single request
+COLUMN_VALUES_TOP_K = 8
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> frozenset:
+    """Lower-cased word tokens with a trailing plural 's' stripped."""
+    words = TOKEN_RE.findall(text.casefold())
+    return frozenset(
+        word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words
+    )
+
+
+# Misspellings such as "earing" or "necklce" still reach their value above this
+FUZZY_MATCH_THRESHOLD = 0.45
+
+# Tokens and per-word trigram vectors of every column value, computed once at import
+_VALUE_TOKENS = {
+    column: [
+        (value, _tokens(value), [embed(word) for word in _tokens(value)])
+        for value in values
+    ]
+    for column, values in COLUMN_VALUES.items()
+}
+
+
+def _value_score(query_tokens: frozenset, value_tokens: frozenset) -> int:
+    """Count value tokens matched by the query, allowing prefixes like grandpa."""
+    score = 0
+    for value_token in value_tokens:
+        if value_token in query_tokens:
+            score += 2
+        elif any(
+            len(token) >= 4 and value_token.startswith(token) for token in query_tokens
+        ):
+            score += 1
+    return score
+
+
+@lru_cache(maxsize=1024)
+def relevant_column_values(query: str) -> str:
+    """Format the top-K values per column for a query.
+
+    Values are ranked by token overlap with the query, then by the cosine
+    similarity of their words to the query words; columns with no match fall
+    back to their most common values so the LLM still sees valid spellings.
+    """
+    query_tokens = _tokens(query)
+    query_tokens |= {VALUE_ALIASES[token] for token in query_tokens if token in VALUE_ALIASES}
+    query_tokens |= _tokens(" ".join(query_tokens))
+    query_vectors = [embed(token) for token in query_tokens if len(token) >= 4]
+
+    lines = ["RELEVANT COLUMN VALUES - USE THESE EXACTLY:"]
+    for column, values in _VALUE_TOKENS.items():
+        scored = []
+        for value, value_tokens, value_vectors in values:
+            score = _value_score(query_tokens, value_tokens)
+            similarity = max(
+                (cosine(q, v) for q in query_vectors for v in value_vectors),
+                default=0.0,
+            )
+            if score or similarity >= FUZZY_MATCH_THRESHOLD:
+                scored.append((score, similarity, value))
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        top = [value for _, _, value in scored[:COLUMN_VALUES_TOP_K]]
+        if not top:
+            top = list(COLUMN_VALUES[column][:COLUMN_VALUES_TOP_K])
+        lines.append(f"{column}: {', '.join(top)}")
+    return "\n".join(lines)
+
+
+# Deterministic SQL for simple "<type> for <person> under <price>" requests
+
+# Words that carry no filter of their own in a simple product request
+FILLER_WORDS = frozenset(
+    """
+    a all an any are can do find for get give have i in inr is jewellery jewelry
+    list looking me most my need of on option our please price product rs see
+    show some the to want what with you your design item gift piece
+    """.split()
+)
+
+CHEAP_WORDS = frozenset({"cheap", "cheapest", "budget", "affordable", "lowest"})
+EXPENSIVE_WORDS = frozenset({"expensive", "costliest", "premium", "luxury", "highest"})
+
+PRICE_RE = re.compile(
+    r"\b(?P<op>under|below|within|less than|upto|up to|above|over|more than)\s+"
+    r"(?:rs\.?\s*|inr\s*|₹\s*)?(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>k|thousand|l|lakh|lakhs)?\b"
+)
+COUNT_RE = re.compile(r"\b(?:top|show|first)\s+(\d+)\b|\b(\d+)\s+(?=\w)")
+# "14 KT white gold" -> metal "14 KT White"; without a colour, "18k gold" -> purity "18 KT"
+METAL_RE = re.compile(
+    r"\b(?P<karat>9|10|14|18|22|24)\s*(?:kt|k|karat|carat)\b"
+    r"(?:\s+(?P<colour>white|yellow|rose))?(?:\s+gold)?\b"
+)
+PRICE_MULTIPLIERS = {"k": 1_000, "thousand": 1_000, "l": 100_000, "lakh": 100_000, "lakhs": 100_000}
+
+
+def _singular(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def _single_word_values(column: str) -> dict:
+    """Map each one-word value of a column to its spelling, most common first."""
+    lookup = {}
+    for value in COLUMN_VALUES[column]:
+        words = TOKEN_RE.findall(value.casefold())
+        if len(words) == 1:
+            lookup.setdefault(_singular(words[0]), value)
+    return lookup
+
+
+_TYPE_WORDS = _single_word_values("jewellery_type")
+_RELATIONSHIP_WORDS = _single_word_values("relationship")
+# "other" is far more often plain English than the Others relationship
+del _RELATIONSHIP_WORDS["other"]
+_OCCASION_WORDS = _single_word_values("occasion")
+
+
+@lru_cache(maxsize=1024)
+def template_sql(query: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """Build SQL for a request made only of known filters, or None if unsure.
+
+    Every word must be a jewellery type, metal, relationship, occasion, price
+    bound, result count, price ordering or filler; anything else goes to the LLM.
+    """
+    text = query.casefold()
+    conditions, params = [], []
+
+    price = PRICE_RE.search(text)
+    if price:
+        amount = float(price.group("amount")) * PRICE_MULTIPLIERS.get(price.group("unit"), 1)
+        operator = ">" if price.group("op") in ("above", "over", "more than") else "<"
+        text = text[: price.start()] + " " + text[price.end() :]
+
+    found = {}
+    # Before the count, which would otherwise read "14 kt" as "show 14"
+    metal = METAL_RE.search(text)
+    if metal:
+        karat, colour = metal.group("karat"), metal.group("colour")
+        column = "metal" if colour else "purity"
+        value = f"{karat} KT {colour.title()}" if colour else f"{karat} KT"
+        if value not in COLUMN_VALUES[column]:
+            return None
+        found[column] = value
+        text = text[: metal.start()] + " " + text[metal.end() :]
+
+    limit = DEFAULT_RESULT_LIMIT
+    count = COUNT_RE.search(text)
+    if count:
+        limit = int(count.group(1) or count.group(2))
+        text = text[: count.start()] + " " + text[count.end() :]
+
+    order = None
+    for word in map(_singular, TOKEN_RE.findall(text)):
+        if word in FILLER_WORDS:
+            continue
+        word = VALUE_ALIASES.get(word, word)
+        for column, lookup in (
+            ("jewellery_type", _TYPE_WORDS),
+            ("relationship", _RELATIONSHIP_WORDS),
+            ("occasion", _OCCASION_WORDS),
+        ):
+            if word in lookup:
+                # Two values for one column ("rings and earrings") needs the LLM
+                if found.setdefault(column, lookup[word]) != lookup[word]:
+                    return None
+                break
+        else:
+            if word in CHEAP_WORDS or word in EXPENSIVE_WORDS:
+                order = "ASC" if word in CHEAP_WORDS else "DESC"
+            else:
+                return None
+
+    if "jewellery_type" not in found:
+        return None
+
+    for column in ("jewellery_type", "metal", "purity", "relationship", "occasion"):
+        if column in found:
+            conditions.append(f"{column} = %s")
+            params.append(found[column])
+    if price:
+        conditions.append(f"price {operator} %s")
+        # Plain digits: "g" would turn 1200000 into "1.2e+06"
+        params.append(str(int(amount)) if amount.is_integer() else f"{amount:f}")
+
+    sql = f"SELECT * FROM product WHERE {' AND '.join(conditions)}"
+    if order:
+        sql += f" ORDER BY price {order}"
+    return f"{sql} LIMIT {limit}", tuple(params)
+
+
+# Built once and never interpolated, so the prompt prefix stays identical across
+# requests; per-request hints are appended after the chat history instead
+SQL_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+# The product columns, built from DESCRIBE and kept for SCHEMA_CACHE_TTL_SECONDS,
+# so the model never spends a turn (or the user's answer) on looking them up
+_schema_message: Optional[SystemMessage] = None
+
+# After a failed DESCRIBE, requests skip the lookup for SCHEMA_RETRY_SECONDS
+# instead of each one waiting on a database that is down
+SCHEMA_RETRY_SECONDS = int(os.getenv("SCHEMA_RETRY_SECONDS", "30"))
+# Monotonic time of the next DESCRIBE, after either a success or a failure
+_schema_refresh_at = 0.0
+
+
+def load_schema_message() -> Optional[SystemMessage]:
+    """Return the product table columns as a system message, or None if unavailable.
+
+    A failed refresh keeps the previously loaded columns, if any.
+    """
+    global _schema_message, _schema_refresh_at
+    if time.monotonic() >= _schema_refresh_at:
+        payload = run_sql_query("DESCRIBE product")
+        if payload.get("results"):
+            columns = "\n".join(
+                f"- {row.get('Field')} {row.get('Type')}" for row in payload["results"]
+            )
+            _schema_message = SystemMessage(content=f"PRODUCT TABLE COLUMNS:\n{columns}")
+            _schema_refresh_at = time.monotonic() + SCHEMA_CACHE_TTL_SECONDS
+        else:
+            _schema_refresh_at = time.monotonic() + SCHEMA_RETRY_SECONDS
+    return _schema_message
 
-        Guidelines:
-        - Use 'jewellery_type' NOT 'category' for product types
-        - Use 'sku' instead of 'name' or 'id' for product identification
-        - Generate valid SQL queries using the EXACT column values above
-        - Use appropriate WHERE clauses for filtering
-        - Return results in a readable format
-        - Focus on product search and filtering queries
 
-        Result Handling:
-        - By default, show 10 results for better readability
-        - If user asks for specific number (e.g., "top 5", "show 3"), add LIMIT clause
-        - For comparison queries (e.g., "silver vs gold", "compare options"), use LIMIT 20-50 to show variety
-        - For broad category searches, consider LIMIT 15-25 for better representation
-        - Always return total count along with limited results
-        - Use ORDER BY price ASC/DESC when appropriate for price-based queries
-        - For expensive items, consider ORDER BY price DESC
-        - For budget items, consider ORDER BY price ASC
+# Upper bound on the queries one LLM response may run, e.g. for comparisons
+MAX_SQL_TOOL_CALLS = int(os.getenv("MAX_SQL_TOOL_CALLS", "4"))
 
-        Pagination Logic:
-        - If user asks "show more", "load more", "next page", or similar pagination requests:
-          1. Go through the chat history and find the LAST executed SQL query that contains a LIMIT clause
-          2. Extract the LIMIT value from that query
-          3. Check if the query already has an OFFSET clause:
-             - If NO OFFSET: Add OFFSET with value equal to the LIMIT value
-             - If OFFSET exists: Add the LIMIT value to the existing OFFSET value
-          4. Execute the modified query with the new OFFSET
-        - Example: If last query was "SELECT * FROM product LIMIT 10", the next query should be "SELECT * FROM product LIMIT 10 OFFSET 10"
-        - Example: If last query was "SELECT * FROM product LIMIT 10 OFFSET 20", the next query should be "SELECT * FROM product LIMIT 10 OFFSET 30"
+# How many recent messages to search for the last query when state has none
+PAGINATION_SCAN_DEPTH = 20
 
-        Examples:
-        - "Show me top 5 expensive rings" → SELECT ... ORDER BY price DESC LIMIT 5
-        - "Show me 3 cheapest earrings" → SELECT ... ORDER BY price ASC LIMIT 3
-        - "Show me rings under 50k" → SELECT ... LIMIT 10 (default)
-        - "Compare silver vs gold options" → SELECT ... LIMIT 25 (for variety)
-        - "Show me budget options" → SELECT ... LIMIT 20 (for comparison)
+PAGINATION_KEYWORDS = frozenset(
+    {
+        "show more",
+        "load more",
+        "next page",
+        "more results",
+        "continue",
+        "pagination",
+        "more",
+        "next",
+        "additional",
+        "further",
+    }
+)
 
-        Always use the execute_sql_query tool to run your SQL queries."""
 
-        # Create messages for the LLM
-        messages = [SystemMessage(content=system_prompt)]
+async def product_filter_node(state: State):
+    """Call the LLM to generate SQL queries based on user input."""
+    try:
+        chat_history = state.get("chat_history", [])
+        query = state.get("query", "")
 
-        # Add the chat history to provide context, filtering out empty messages
-        for msg in chat_history:
-            if hasattr(msg, "content") and msg.content and str(msg.content).strip():
-                messages.append(msg)
+        # Create messages for the LLM; chat history only ever holds non-empty messages
+        messages = [SQL_SYSTEM_MESSAGE, *chat_history]
+        history = chat_history
+        # Everything besides the query that shapes the generated SQL
+        cache_prompt = SYSTEM_PROMPT
 
         # Add pagination context if this is a pagination request
-        pagination_keywords = [
-            "show more",
-            "load more",
-            "next page",
-            "more results",
-            "continue",
-            "pagination",
-            "more",
-            "next",
-            "additional",
-            "further",
-        ]
-        if query and any(keyword in query.lower() for keyword in pagination_keywords):
-            # Find the last query with LIMIT clause from chat history
-            last_query_with_limit = None
-            for msg in reversed(chat_history):
+        query_lower = query.lower()
+        is_pagination = bool(query) and any(
+            keyword in query_lower for keyword in PAGINATION_KEYWORDS
+        )
+        if is_pagination:
+            # Prefer the query remembered in state; only scan recent history without it
+            last_sql = state.get("last_sql") or {}
+            last_query_with_limit = last_sql.get("query")
+            last_query_params = last_sql.get("params") or []
+            recent_messages = islice(reversed(chat_history), PAGINATION_SCAN_DEPTH)
+            for msg in recent_messages if not last_query_with_limit else ():
                 if hasattr(msg, "content") and msg.content:
                     content = str(msg.content)
                     if "SQL Query Result:" in content:
                         try:
-                            import json
-
                             json_start = content.find("SQL Query Result: ") + len(
                                 "SQL Query Result: "
                             )
                             json_content = content[json_start:].strip()
-                            result_data = json.loads(json_content)
+                            result_data = orjson.loads(json_content)
                             query_text = result_data.get("query", "")
-                            if "LIMIT" in query_text:
+                            if get_sql_limit(query_text) is not None:
                                 last_query_with_limit = query_text
+                                last_query_params = result_data.get("params") or []
                                 break
                         except:  # noqa: E722
                             continue
@@ -289,6 +854,7 @@ def product_filter_node(state: State):
         You need to paginate the following query by adding OFFSET:
 
         LAST QUERY: {last_query_with_limit}
+        LAST QUERY PARAMS: {json.dumps(last_query_params)}
 
         CRITICAL: You MUST add OFFSET to this exact query. Do not create a new query.
 
@@ -298,11 +864,11 @@ def product_filter_node(state: State):
         3. Create a new query with appropriate OFFSET:
            - If no OFFSET: add OFFSET equal to LIMIT value
            - If OFFSET exists: add LIMIT value to existing OFFSET
-        4. Execute the modified query using the execute_sql_query tool
+        4. Execute the modified query using the execute_sql_query tool, passing the same params
 
         Example:
-        - Last query: "SELECT * FROM product WHERE metal = 'Gold' LIMIT 20"
-        - New query: "SELECT * FROM product WHERE metal = 'Gold' LIMIT 20 OFFSET 20"
+        - Last query: "SELECT * FROM product WHERE metal = %s LIMIT 20" with params ["18 KT Yellow"]
+        - New query: "SELECT * FROM product WHERE metal = %s LIMIT 20 OFFSET 20" with params ["18 KT Yellow"]
 
         IMPORTANT: You must use the execute_sql_query tool to run the paginated query.
         """
@@ -334,92 +900,158 @@ def product_filter_node(state: State):
         IMPORTANT: You must use the execute_sql_query tool to run the paginated query.
         """
             messages.append(SystemMessage(content=pagination_context))
+            cache_prompt += pagination_context
 
-        # Add the user query
+        # Add the user query with only the column values it is likely to need
         if query and query.strip():
+            messages.append(SystemMessage(content=relevant_column_values(query)))
             messages.append(HumanMessage(content=query))
         else:
             logger.warning("Empty or invalid query provided")
-            return {"chat_history": chat_history, "response": None}
-
-        # Generate SQL query using LLM with tools
-        response = llm_with_tools.invoke(messages)
-
-        # Append the response to chat history instead of replacing it
-        updated_chat_history = chat_history + [response]
+            return {"response": None}
+
+        # Simple filter requests map straight to SQL; only the rest need the LLM
+        template = None if is_pagination else template_sql(query)
+        if template:
+            sql, params = template
+            response = AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": "execute_sql_query",
+                        "args": {"query": sql, "params": list(params)},
+                        "id": str(uuid.uuid4()),
+                    }
+                ],
+            )
+            logger.info("SQL query built from template")
+        else:
+            schema_message = _schema_message
+            if time.monotonic() >= _schema_refresh_at:
+                schema_message = await asyncio.get_running_loop().run_in_executor(
+                    sql_executor, load_schema_message
+                )
+            if schema_message:
+                # Right after the fixed prompt, so the shared prefix stays stable
+                messages.insert(1, schema_message)
+                cache_prompt += schema_message.content
+
+            # Generate SQL query using LLM with tools, reusing cached SQL for repeat queries.
+            # Only exact repeats: paraphrase matching can't tell "rings" from "earrings"
+            response = await cached_invoke(
+                llm_with_tools,
+                messages,
+                system_prompt=cache_prompt,
+                history=history,
+                query=query,
+                semantic=False,
+            )
+            logger.info("SQL query generated successfully")
 
-        logger.info("SQL query generated successfully")
+        # Run the generated SQL in this step instead of a separate graph hop
+        update = await execute_tool_calls(response)
 
-        return {"chat_history": updated_chat_history, "response": response}
+        # Only the new messages are returned; the state reducer appends them
+        update["chat_history"] = with_content(response, *update.get("chat_history", []))
+        update.setdefault("response", response)
+        return update
 
     except Exception as e:
-        logger.error(f"Error in SQL generation: {e}")
-        # Return the original chat history if there's an error
-        return {"chat_history": chat_history, "response": None}
-
-
-def query_executor_node(state: State):
-    """Execute the tool calls from the LLM response."""
+        logger.error("Error in SQL generation: %s", e)
+        # Leave the chat history untouched if there's an error
+        return {"response": None}
+
+
+async def run_sql_tool_call(tool_call: dict) -> BaseMessage:
+    """Run one execute_sql_query tool call and wrap its result in a message."""
+    tool_name = tool_call["name"]
+    tool_args = tool_call["args"]
+
+    # The MySQL driver is blocking, so keep it off the event loop
+    payload = await asyncio.get_running_loop().run_in_executor(
+        sql_executor,
+        run_sql_query,
+        tool_args.get("query", ""),
+        tool_args.get("params") or [],
+    )
+    # Whether the result came from cache is for API clients only; leaving it out of
+    # the content keeps identical results byte-identical for the LLM caches
+    result = dump_result({k: v for k, v in payload.items() if k != "cache_hit"})
+
+    # Create a tool message - the tool call has an 'id' field
+    tool_call_id = tool_call.get("id")
+    if not tool_call_id:
+        logger.error("Could not find id in tool_call: %s", tool_call)
+        # Generate a unique ID if none exists
+        tool_call_id = str(uuid.uuid4())
+
+    # Create a regular AIMessage instead of ToolMessage to avoid Redis serialization issues
+    tool_message = AIMessage(
+        content=f"SQL Query Result: {result}",
+        additional_kwargs={
+            "tool_call_id": tool_call_id,
+            "tool_name": tool_name,
+            "tool_result": result,
+            # The payload itself, so API responses don't have to parse the content
+            "parsed": payload,
+        },
+    )
+
+    logger.info("Tool execution completed: %s", tool_name)
+    return tool_message
+
+
+async def execute_tool_calls(last_message: BaseMessage) -> dict:
+    """Execute the tool calls from the LLM response and return the state update."""
     try:
-        chat_history = state.get("chat_history", [])
-
-        # Get the last message which should have tool calls
-        if not chat_history:
-            logger.warning("No chat history to execute tools from")
-            return {"chat_history": chat_history}
-
-        last_message = chat_history[-1]
-
         # Check if the message has tool calls
         if not hasattr(last_message, "tool_calls") or not last_message.tool_calls:
             logger.info("No tool calls to execute")
-            return {"chat_history": chat_history}
+            return {}
 
-        # Execute each tool call
-        tool_results = []
+        sql_calls = []
         for tool_call in last_message.tool_calls:
-            tool_name = tool_call["name"]
-            tool_args = tool_call["args"]
-
-            logger.info(f"Executing tool: {tool_name} with args: {tool_args}")
-
-            # Execute the tool
-            if tool_name == "execute_sql_query":
-                query = tool_args.get("query", "")
-                result = execute_sql_query.invoke(query)
-                tool_results.append(result)
-
-                # Create a tool message - the tool call has an 'id' field
-                tool_call_id = tool_call.get("id")
-                if not tool_call_id:
-                    logger.error(f"Could not find id in tool_call: {tool_call}")
-                    # Generate a unique ID if none exists
-                    import uuid
-
-                    tool_call_id = str(uuid.uuid4())
-
-                # Create a regular AIMessage instead of ToolMessage to avoid Redis serialization issues
-                from langchain_core.messages import AIMessage
-
-                tool_message = AIMessage(
-                    content=f"SQL Query Result: {result}",
-                    additional_kwargs={
-                        "tool_call_id": tool_call_id,
-                        "tool_name": tool_name,
-                        "tool_result": result,
-                    },
-                )
-
-                # Append the tool message to chat history
-                updated_chat_history = chat_history + [tool_message]
-
-                logger.info(f"Tool execution completed: {tool_name}")
+            logger.info(
+                "Executing tool: %s with args: %s", tool_call["name"], tool_call["args"]
+            )
+            if tool_call["name"] == "execute_sql_query":
+                sql_calls.append(tool_call)
+            else:
+                logger.warning("Ignoring unknown tool: %s", tool_call["name"])
+
+        # If no tools were executed, leave the chat history untouched
+        if not sql_calls:
+            return {}
+        if len(sql_calls) > MAX_SQL_TOOL_CALLS:
+            logger.warning(
+                "Running %d of %d SQL tool calls", MAX_SQL_TOOL_CALLS, len(sql_calls)
+            )
+            sql_calls = sql_calls[:MAX_SQL_TOOL_CALLS]
 
-                return {"chat_history": updated_chat_history, "response": tool_message}
+        # Independent queries run concurrently, each on its own pooled connection
+        tool_messages = await asyncio.gather(
+            *(run_sql_tool_call(tool_call) for tool_call in sql_calls)
+        )
 
-        # If no tools were executed, return original chat history
-        return {"chat_history": chat_history}
+        update = {
+            "chat_history": with_content(*tool_messages),
+            "response": tool_messages[-1],
+            "sql_result": tool_messages[-1].additional_kwargs["parsed"],
+        }
+        paginated = [
+            tool_call["args"]
+            for tool_call in sql_calls
+            # Parsed, so a lowercase "limit" counts and a column name does not
+            if get_sql_limit(tool_call["args"].get("query", "")) is not None
+        ]
+        if paginated:
+            # Remember the query so a follow-up "show more" needs no history scan
+            update["last_sql"] = {
+                "query": paginated[-1]["query"],
+                "params": paginated[-1].get("params") or [],
+            }
+        return update
 
     except Exception as e:
-        logger.error(f"Error executing tools: {e}")
-        return {"chat_history": chat_history}
+        logger.error("Error executing tools: %s", e)
+        return {}
@@ -1,8 +1,3 @@
-from llm import get_llm
-from langchain_core.messages import SystemMessage, HumanMessage
-from state.state import State
-
-
 """
 Store Analysis Agent - WORK IN PROGRESS
 
@@ -17,22 +12,16 @@ TODO:
 Status: Not Implemented
 """
 
-llm = get_llm()
-
-
-prompt_txt = """
-TO BE UPDATED
-"""
+from langchain_core.messages import AIMessage
+from state.state import State
 
+COMING_SOON_MESSAGE = "Store analysis is coming soon"
 
-def store_analysis_node(state: State):
-    """Call the LLM with the current state."""
-    query = state.get("query", "")
 
-    messages = [
-        SystemMessage(content=prompt_txt),
-        HumanMessage(content=query),
-    ]
+async def store_analysis_node(state: State):
+    """Reply with a placeholder until store analysis is implemented.
 
-    response = llm.invoke(messages)
-    return {"chat_history": [response], "response": "Store analysis is coming soon"}
+    No LLM call is made: there is no prompt yet, and its answer was discarded.
+    """
+    response = AIMessage(content=COMING_SOON_MESSAGE)
+    return {"chat_history": [response], "response": response}
@@ -1,7 +1,8 @@
 import logging
 from llm import get_llm
 from langchain_core.messages import SystemMessage, HumanMessage
-from state.state import State
+from state.state import State, with_content
+from agents.llm_cache import cached_invoke
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -10,47 +11,51 @@ logger = logging.getLogger(__name__)
 # Initialize the LLM
 llm = get_llm()
 
+# Static prompt kept byte-identical across requests so the provider can reuse
+# its cached prefix; per-request data only ever goes in trailing messages
+SUMMARY_PROMPT = """You are a helpful assistant that creates concise summaries of product search results.
 
-def summary_node(state: State):
-    """Generate a summary from the SQL query results."""
-    try:
-        chat_history = state.get("chat_history", [])
-        query = state.get("query", "")
+Based on the SQL query results, provide a clear summary that includes:
+- Number of products found
+- Key characteristics (price range, material, etc.)
+- Any relevant insights
+- Currency is INR
 
-        # Create system prompt for summary generation
-        system_prompt = """You are a helpful assistant that creates concise summaries of product search results.
+Keep the summary concise and informative."""
 
-        Based on the SQL query results, provide a clear summary that includes:
-        - Number of products found
-        - Key characteristics (price range, material, etc.)
-        - Any relevant insights
-        - Currency is INR
+SUMMARY_SYSTEM_MESSAGE = SystemMessage(content=SUMMARY_PROMPT)
 
-        Keep the summary concise and informative."""
 
-        # Create messages for the LLM
-        messages = [SystemMessage(content=system_prompt)]
+async def summary_node(state: State):
+    """Generate a summary from the SQL query results."""
+    try:
+        chat_history = state.get("chat_history", [])
+        query = state.get("query", "")
 
-        # Add the chat history to provide context, filtering out empty messages
-        for msg in chat_history:
-            if hasattr(msg, 'content') and msg.content and str(msg.content).strip():
-                messages.append(msg)
+        # Create messages for the LLM; chat history only ever holds non-empty messages
+        messages = [SUMMARY_SYSTEM_MESSAGE, *chat_history]
 
         # Add the user query for context
         if query:
             messages.append(HumanMessage(content=f"User query: {query}"))
 
-        # Generate summary
-        response = llm.invoke(messages)
-
-        # Append the response to chat history instead of replacing it
-        updated_chat_history = chat_history + [response]
+        # The summary describes this turn's SQL results, so they and the query key
+        # the cache; older history only matters when there are no fresh results
+        tool_results = [msg for msg in chat_history if "parsed" in msg.additional_kwargs]
+        response = await cached_invoke(
+            llm,
+            messages,
+            system_prompt=SUMMARY_PROMPT,
+            history=tool_results or (messages[1:-1] if query else messages[1:]),
+            query=query,
+        )
 
         logger.info("Summary generated successfully")
 
-        return {"chat_history": updated_chat_history, "response": response}
+        # Only the new message is returned; the state reducer appends it
+        return {"chat_history": with_content(response), "response": response}
 
     except Exception as e:
-        logger.error(f"Error in summary generation: {e}")
-        # Return the original chat history if there's an error
-        return {"chat_history": chat_history, "response": None}
+        logger.error("Error in summary generation: %s", e)
+        # Leave the chat history untouched if there's an error
+        return {"response": None}
@@ -1,24 +1,70 @@
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
-from agents.orchestrator_agent import invoke_orchestrator
+import os
+import secrets
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import orjson
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from agents.orchestrator_agent import (
+    flush_pending_saves,
+    invoke_orchestrator,
+    stream_orchestrator,
+)
+from agents.product_filter_agent import clear_sql_result_cache, load_schema_message
 from helpers.api_helper import extract_summary_content, extract_result_content
+from helpers.db_helper import warm_up_db_pool
 from api_model import ChatResponse, ChatRequest
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; the agent modules configure INFO on import, so set the
+# root level here from LOG_LEVEL (e.g. WARNING to keep logging off the hot path)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL)
+logging.getLogger().setLevel(LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="CaratLane Store Agent API")
+HEALTH_PATH = "/health"
+# Shared secret for the /admin endpoints, sent as X-Admin-Key; unset disables them
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+# The health check never changes, so its body is encoded once
+HEALTH_RESPONSE_BODY = orjson.dumps({"status": "healthy"})
+
+
+class SkipHealthCheckAccessLog(logging.Filter):
+    """Keep load balancer health probes out of the uvicorn access log."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # uvicorn.access args: (client, method, path, http version, status)
+        args = record.args
+        return not (isinstance(args, tuple) and len(args) > 2 and args[2] == HEALTH_PATH)
+
+
+logging.getLogger("uvicorn.access").addFilter(SkipHealthCheckAccessLog())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the MySQL connections and read the product schema before serving,
+    # not on the first user query
+    if await asyncio.to_thread(warm_up_db_pool):
+        await asyncio.to_thread(load_schema_message)
+    yield
+    # Chat history is saved in the background; don't drop it on shutdown
+    await flush_pending_saves()
+
+
+app = FastAPI(title="CaratLane Store Agent API", lifespan=lifespan)
 
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Process a chat request through the orchestrator."""
     try:
-        logger.info(f"Processing query: {request.query}")
+        logger.info("Processing query: %s", request.query)
 
         # Invoke the orchestrator
-        orchestrator_result = invoke_orchestrator(request.query, request.user_email)
+        orchestrator_result = await invoke_orchestrator(request.query, request.user_email)
 
         if "error" in orchestrator_result:
             raise HTTPException(status_code=500, detail=orchestrator_result["error"])
@@ -27,24 +73,91 @@ async def chat(request: ChatRequest):
         summary = extract_summary_content(orchestrator_result)
         result_data, sql_query = extract_result_content(orchestrator_result)
 
-        logger.info(f"Query: {sql_query}")
-        logger.info(f"Results: {result_data}")
-        logger.info(f"Summary: {summary}")
+        logger.info("Query: %s", sql_query)
+        # The rows can be large, so only log them when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Results: %s", result_data)
+        logger.info("Summary: %s", summary)
 
         return ChatResponse(summary=summary, query=sql_query, result=result_data)
 
     except Exception as e:
-        logger.error(f"Error processing chat request: {e}")
+        logger.error("Error processing chat request: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/health")
+def ndjson_line(event: dict) -> bytes:
+    """Encode one stream event as a line of newline-delimited JSON."""
+    return orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
+
+
+async def chat_events(request: ChatRequest) -> AsyncIterator[bytes]:
+    """Translate orchestrator events into the NDJSON events sent to the client."""
+    summary_streamed = False
+    async for event in stream_orchestrator(request.query, request.user_email):
+        if "error" in event:
+            yield ndjson_line({"event": "error", "data": event["error"]})
+            return
+
+        if "token" in event:
+            summary_streamed = True
+            yield ndjson_line({"event": "summary_token", "data": event["token"]})
+        elif event["node"] == "product_filter_node":
+            # Send the rows as soon as the SQL has run, before the summary starts
+            result_data, sql_query = extract_result_content(event["update"])
+            yield ndjson_line({"event": "results", "query": sql_query, "data": result_data})
+        elif not summary_streamed:
+            # Cached or non-streaming answers arrive whole with the node update
+            summary = extract_summary_content(event["update"])
+            yield ndjson_line({"event": "summary", "data": summary})
+
+    yield ndjson_line({"event": "done"})
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream SQL results and then the summary tokens as newline-delimited JSON."""
+    logger.info("Streaming query: %s", request.query)
+    return StreamingResponse(chat_events(request), media_type="application/x-ndjson")
+
+
+@app.post("/admin/sql-cache/invalidate")
+async def invalidate_sql_cache(x_admin_key: Optional[str] = Header(None)):
+    """Drop cached SQL results, e.g. after a catalog update.
+
+    The cache lives in the worker process, so only this worker is cleared.
+    """
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not x_admin_key or not secrets.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+    removed = clear_sql_result_cache()
+    logger.info("Invalidated %d cached SQL results", removed)
+    return {"invalidated": removed}
+
+
+@app.get(HEALTH_PATH)
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy"}
+    return Response(content=HEALTH_RESPONSE_BODY, media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multiple workers need the app as an import string; uvloop and httptools
+    # come with uvicorn[standard]. The default is one worker because state is
+    # per process: a follow-up request waits for the previous turn's history
+    # save only within its own worker, and the SQL and LLM caches, including
+    # /admin/sql-cache/invalidate, are not shared. Only raise UVICORN_WORKERS
+    # behind a load balancer that pins each user to one worker.
+    uvicorn.run(
+        "api_controller:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("UVICORN_WORKERS", "1")),
+        log_level=LOG_LEVEL.lower(),
+    )
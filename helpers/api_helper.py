@@ -1,9 +1,13 @@
 import logging
+import orjson
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Prefix of the messages that carry SQL tool results
+SQL_RESULT_PREFIX = "SQL Query Result: "
+
 
 def extract_summary_content(orchestrator_result: dict) -> str:
     """Extract summary content from orchestrator result."""
@@ -15,72 +19,83 @@ def extract_summary_content(orchestrator_result: dict) -> str:
     if response and hasattr(response, "content"):
         return str(response.content)
 
-    # Fallback: look for summary in chat history
+    # Fallback: the latest AI message in chat history that isn't a SQL result
     chat_history = orchestrator_result.get("chat_history", [])
     for msg in reversed(chat_history):  # Start from the end
-        if hasattr(msg, "content") and msg.content:
+        if msg.type == "ai" and msg.content:
             content = str(msg.content)
-            if "rings" in content.lower() or "products" in content.lower():
+            if not content.startswith(SQL_RESULT_PREFIX):
                 return content
 
     return "Summary not available"
 
 
+def format_result_data(parsed_result: dict) -> dict:
+    """Pick the fields of a SQL result payload that the API returns."""
+    count = parsed_result.get("count", 0)
+
+    # Extract the actual data; the rows are shared, not copied
+    return {
+        "count": count,
+        "results": parsed_result.get("results", []),
+        "params": parsed_result.get("params", []),
+        "message": parsed_result.get("message", ""),
+        "total_available": parsed_result.get("total_available", count),
+        "showing": parsed_result.get("showing", count),
+        "has_more": parsed_result.get("has_more", False),
+        "cache_hit": parsed_result.get("cache_hit", False),
+    }
+
+
 def extract_result_content(orchestrator_result: dict) -> tuple:
     """Extract result content and SQL query from orchestrator result."""
     if not orchestrator_result or not isinstance(orchestrator_result, dict):
         return {}, "Query executed"
 
     sql_query = "Query executed"
-    result_data = {}
+
+    # State carries this turn's result directly; results found in the chat
+    # history may be from earlier turns
+    if "sql_result" in orchestrator_result:
+        parsed_result = orchestrator_result["sql_result"]
+        if isinstance(parsed_result, dict):
+            sql_query = parsed_result.get("query", sql_query)
+            return format_result_data(parsed_result), sql_query
+        return {"message": "User query processed successfully"}, sql_query
 
     # Look for tool results in chat history
     chat_history = orchestrator_result.get("chat_history", [])
 
     # Find the AIMessage that contains the SQL execution results (now using AIMessage instead of ToolMessage)
-    # Iterate in reverse to get the most recent results
+    # Iterate in reverse so the most recent result is found first
     for msg in reversed(chat_history):
-        if hasattr(msg, "type") and msg.type == "ai":
-            content = str(msg.content)
-            # This should contain the SQL results with count, results, query
-            if "SQL Query Result:" in content:
+        if msg.type == "ai":
+            # Results from this turn carry the payload; only reloaded history needs parsing
+            parsed_result = msg.additional_kwargs.get("parsed")
+            if parsed_result is None:
+                content = str(msg.content)
+                # Result messages start with the prefix, so no substring search is needed
+                if not content.startswith(SQL_RESULT_PREFIX):
+                    continue
                 try:
-                    import json
-
                     # Extract the JSON part after "SQL Query Result: "
-                    json_start = content.find("SQL Query Result: ") + len("SQL Query Result: ")
-                    json_content = content[json_start:].strip()
+                    json_content = content[len(SQL_RESULT_PREFIX) :].strip()
 
                     # Parse the JSON content from the tool message
-                    parsed_result = json.loads(json_content)
-                    if isinstance(parsed_result, dict):
-                        # Extract the SQL query
-                        if "query" in parsed_result:
-                            sql_query = parsed_result["query"]
-
-                        # Extract the actual data
-                        result_data = {
-                            "count": parsed_result.get("count", 0),
-                            "results": parsed_result.get("results", []),
-                            "message": parsed_result.get("message", ""),
-                            "total_available": parsed_result.get(
-                                "total_available", parsed_result.get("count", 0)
-                            ),
-                            "showing": parsed_result.get(
-                                "showing", parsed_result.get("count", 0)
-                            ),
-                            "has_more": parsed_result.get("has_more", False),
-                        }
-                        return result_data, sql_query
-
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse tool result as JSON: {e}")
-                    logger.warning(f"Content was: {content}")
-                    continue
+                    parsed_result = orjson.loads(json_content)
+                except orjson.JSONDecodeError as e:
+                    # An older result would be stale, so stop at the latest one
+                    logger.warning("Failed to parse tool result as JSON: %s", e)
+                    logger.warning("Content was: %s", content)
+                    break
                 except Exception as e:
-                    logger.warning(f"Failed to parse tool result: {e}")
-                    logger.warning(f"Content was: {content}")
-                    continue
+                    logger.warning("Failed to parse tool result: %s", e)
+                    logger.warning("Content was: %s", content)
+                    break
+
+            if isinstance(parsed_result, dict):
+                sql_query = parsed_result.get("query", sql_query)
+                return format_result_data(parsed_result), sql_query
 
     # If we didn't find tool results, return fallback
     return {"message": "User query processed successfully"}, sql_query
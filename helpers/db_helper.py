@@ -1,5 +1,5 @@
-import mysql.connector
-from mysql.connector import Error
+import threading
+from mysql.connector import HAVE_CEXT, Error, pooling
 from dotenv import load_dotenv
 import os
 
@@ -9,14 +9,52 @@ DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> pooling.MySQLConnectionPool:
+    """Return the CaratLane Stage connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="caratlane",
+                    pool_size=DB_POOL_SIZE,
+                    host=DB_HOST,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    database=DB_NAME,
+                    # Read-only workload: no transaction (and no stale snapshot)
+                    # is held open on a pooled connection between queries
+                    autocommit=True,
+                    # Decode result sets in the C extension when it is installed;
+                    # asking for it when it is missing fails every connection
+                    use_pure=not HAVE_CEXT,
+                )
+    return _pool
+
+
+def warm_up_db_pool() -> bool:
+    """Create the pool up front; it opens all DB_POOL_SIZE connections eagerly."""
+    try:
+        get_db_pool()
+        return True
+    except Error as e:
+        print(f"Error warming up CaratLane Stage Database pool: {e}")
+        return False
 
 
 def get_db_connection():
-    """Establish and return a connection to the CaratLane Stage MySQL database."""
+    """Borrow a connection to the CaratLane Stage MySQL database from the pool.
+
+    Calling ``close()`` on the returned connection hands it back to the pool.
+    """
     try:
-        conn = mysql.connector.connect(
-            host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME
-        )
+        conn = get_db_pool().get_connection()
         return conn
     except Error as e:
         print(f"Error connecting to CaratLane Stage Database: {e}")
@@ -1,82 +1,122 @@
-import json
-import redis
+import msgpack
+import orjson
+import re
+import redis.asyncio as redis
 import os
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Only the most recent messages are kept and loaded into the prompt context
+MAX_HISTORY = 100
+
+# Idle sessions expire so abandoned histories don't hold Redis memory forever
+CHAT_HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL_SECONDS", "3600"))
+
+# New entries are a version byte followed by MessagePack, which is smaller and
+# faster to decode than JSON. Entries starting with "{" are JSON and still load,
+# so setting CHAT_HISTORY_CODEC=json lets a rollback drain msgpack entries first.
+CHAT_HISTORY_CODEC = os.getenv("CHAT_HISTORY_CODEC", "msgpack")
+MSGPACK_ENTRY_VERSION = b"\x01"
+
+# Prefix of the AI messages that carry SQL tool results
+SQL_RESULT_PREFIX = "SQL Query Result: "
+
+# Fallbacks for pulling the SQL out of a result that is not valid JSON
+QUERY_RE = re.compile(r'"query":\s*"([^"]*(?:\\.[^"]*)*)"', re.DOTALL)
+QUERY_RE_SIMPLE = re.compile(r'"query":\s*"([^"]+)"')
+
+
+# Connections per worker process; callers wait for a free one instead of failing
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+
+
+@lru_cache(maxsize=None)
+def get_redis_client(redis_url: str) -> redis.Redis:
+    """Return one shared asyncio Redis client (and connection pool) per URL."""
+    pool = redis.BlockingConnectionPool.from_url(
+        redis_url, max_connections=REDIS_MAX_CONNECTIONS
+    )
+    return redis.Redis(connection_pool=pool)
+
 
 class SimpleRedisChatHistory:
-    """Simple Redis chat history implementation that works with regular Redis."""
+    """Simple Redis chat history implementation that works with regular Redis.
+
+    Messages are stored one entry each in a Redis list, so appending never has
+    to read or rewrite the existing history. Entries are written by
+    encode_entry(): a 0x01 version byte followed by MessagePack, or a JSON
+    document when CHAT_HISTORY_CODEC=json. Both formats are read back.
+    """
 
     def __init__(self, redis_url: str, session_id: str):
-        self.redis_client = redis.from_url(redis_url)
+        self.redis_client = get_redis_client(redis_url)
         self.session_id = session_id
-        self.key = f"chat:{session_id}"
-
-    def add_message(self, message: BaseMessage):
-        """Add a single message to the chat history."""
-        self.add_messages([message])
+        self.key = f"chat:{session_id}:messages"
+        self.last_sql_key = f"chat:{session_id}:last_sql"
 
-    def add_messages(self, messages: List[BaseMessage]):
-        """Add multiple messages to the chat history."""
+    async def add_messages(
+        self, messages: List[BaseMessage], last_sql: Optional[Dict[str, Any]] = None
+    ):
+        """Append messages (and optionally the last paginated query) in one round trip."""
         try:
-            # Get existing messages
-            existing_messages = self.get_messages()
-
-            # Add new messages
-            all_messages = existing_messages + messages
-
-            # Serialize all messages to JSON array
-            messages_json = json.dumps(
-                [self._serialize_message(msg) for msg in all_messages]
-            )
-
-            # Store as single JSON string in Redis
-            self.redis_client.set(self.key, messages_json)
-            logger.info(
-                f"Added {len(messages)} messages to Redis (total: {len(all_messages)})"
-            )
+            pipe = self.redis_client.pipeline(transaction=True)
+            if messages:
+                pipe.rpush(
+                    self.key,
+                    *[encode_entry(self._serialize_message(msg)) for msg in messages],
+                )
+                # Only the newest MAX_HISTORY are ever loaded, so drop the rest
+                pipe.ltrim(self.key, -MAX_HISTORY, -1)
+            if last_sql:
+                pipe.set(self.last_sql_key, orjson.dumps(last_sql))
+            pipe.expire(self.key, CHAT_HISTORY_TTL_SECONDS)
+            pipe.expire(self.last_sql_key, CHAT_HISTORY_TTL_SECONDS)
+            await pipe.execute()
+            logger.info("Added %d messages to Redis", len(messages))
         except Exception as e:
-            logger.error(f"Failed to add messages to Redis: {e}")
+            logger.error("Failed to add messages to Redis: %s", e)
             raise
 
-    def get_messages(self) -> List[BaseMessage]:
-        """Retrieve all messages from the chat history."""
-        try:
-            # Get the JSON string from Redis
-            messages_json = self.redis_client.get(self.key)
-
-            if not messages_json:
-                return []
-
-            # Parse the JSON array
-            message_dicts = json.loads(messages_json)
-            messages = []
-
-            for message_dict in message_dicts:
-                try:
-                    message = self._deserialize_message(message_dict)
-                    messages.append(message)
-                except Exception as e:
-                    logger.warning(f"Failed to deserialize message: {e}")
-                    continue
-
-            logger.info(f"Retrieved {len(messages)} messages from Redis")
-            return messages
-        except Exception as e:
-            logger.error(f"Failed to get messages from Redis: {e}")
-            return []
+    async def load(
+        self, limit: int = MAX_HISTORY
+    ) -> Tuple[List[BaseMessage], Optional[Dict[str, Any]]]:
+        """Retrieve the last ``limit`` messages and the last paginated query.
+
+        LLEN, LRANGE and GET are sent as a single MULTI/EXEC round trip.
+        """
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.llen(self.key)
+        pipe.lrange(self.key, -limit, -1)
+        pipe.get(self.last_sql_key)
+        length, raw_messages, last_sql_json = await pipe.execute()
 
-    def clear(self):
+        last_sql = orjson.loads(last_sql_json) if last_sql_json else None
+        if length == 0:
+            return [], last_sql
+
+        messages = []
+        for raw_message in raw_messages:
+            try:
+                message_class, content = decode_entry(raw_message)
+                messages.append(message_class(content=content))
+            except Exception as e:
+                logger.warning("Failed to deserialize message: %s", e)
+                continue
+
+        logger.info("Retrieved %d of %d messages from Redis", len(messages), length)
+        return messages, last_sql
+
+    async def clear(self):
         """Clear all messages from the chat history."""
         try:
-            self.redis_client.delete(self.key)
+            await self.redis_client.delete(self.key, self.last_sql_key)
             logger.info("Cleared chat history from Redis")
         except Exception as e:
-            logger.error(f"Failed to clear chat history: {e}")
+            logger.error("Failed to clear chat history: %s", e)
 
     def _serialize_message(self, message: BaseMessage) -> Dict[str, Any]:
         """Serialize a LangChain message to a compact dictionary."""
@@ -87,33 +127,28 @@ class SimpleRedisChatHistory:
         }
 
         # For AI messages with SQL results, extract and store only the SQL query
-        if (
-            message.type == "ai"
-            and hasattr(message, "content")
-            and message.content
-            and "SQL Query Result:" in str(message.content)
-        ):
+        content_str = str(message.content) if message.type == "ai" else ""
+        if content_str.startswith(SQL_RESULT_PREFIX):
             try:
-                import json
-
-                content_str = str(message.content)
-                json_start = content_str.find("SQL Query Result: ") + len(
-                    "SQL Query Result: "
-                )
-                json_content = content_str[json_start:].strip()
+                sql_params = []
+                row_count = None
+                # Results from this turn carry their payload, so nothing needs parsing
+                result_data = message.additional_kwargs.get("parsed")
+                if not isinstance(result_data, dict):
+                    json_content = content_str[len(SQL_RESULT_PREFIX) :].strip()
+                    try:
+                        result_data = orjson.loads(json_content)
+                    except orjson.JSONDecodeError:
+                        result_data = None
 
-                # Try to parse JSON, if it fails, use regex extraction
-                try:
-                    result_data = json.loads(json_content)
+                if isinstance(result_data, dict):
                     sql_query = result_data.get("query", "")
-                except json.JSONDecodeError:
+                    sql_params = result_data.get("params") or []
+                    row_count = result_data.get("count")
+                else:
                     # Use regex to extract query from malformed JSON
-                    import re
-
                     # More robust regex to handle escaped quotes and complex SQL
-                    query_match = re.search(
-                        r'"query":\s*"([^"]*(?:\\.[^"]*)*)"', json_content, re.DOTALL
-                    )
+                    query_match = QUERY_RE.search(json_content)
                     if query_match:
                         sql_query = (
                             query_match.group(1)
@@ -123,7 +158,7 @@ class SimpleRedisChatHistory:
                         )
                     else:
                         # Fallback: try to find query between quotes more broadly
-                        query_match = re.search(r'"query":\s*"([^"]+)"', json_content)
+                        query_match = QUERY_RE_SIMPLE.search(json_content)
                         if query_match:
                             sql_query = query_match.group(1)
                         else:
@@ -131,9 +166,15 @@ class SimpleRedisChatHistory:
 
                 if sql_query:
                     message_dict["sql_query"] = sql_query
-                    message_dict["content"] = f"SQL Query executed: {sql_query}"
+                    if sql_params:
+                        message_dict["sql_params"] = sql_params
+                    # Keep only the row count of the result set, never the rows
+                    if row_count is not None:
+                        message_dict["row_count"] = row_count
+                    # The content is rebuilt from sql_query on load, so don't store it twice
+                    message_dict["content"] = ""
             except Exception as e:
-                logger.warning(f"Could not extract SQL query from message: {e}")
+                logger.warning("Could not extract SQL query from message: %s", e)
 
         # For tool calls, store only essential information
         if hasattr(message, "tool_calls") and message.tool_calls:
@@ -155,28 +196,60 @@ class SimpleRedisChatHistory:
 
         return message_dict
 
-    def _deserialize_message(self, message_dict: Dict[str, Any]) -> BaseMessage:
-        """Deserialize a dictionary back to a LangChain message."""
-        msg_type = message_dict.get("type", "human")
-        content = message_dict.get("content", "")
-
-        # Create the appropriate message type
-        if msg_type == "human":
-            return HumanMessage(content=content)
-        elif msg_type == "ai":
-            # For AI messages, reconstruct the full content if we have SQL query
-            if "sql_query" in message_dict:
-                # Reconstruct the SQL Query Result format for pagination analysis
-                sql_query = message_dict["sql_query"]
-                reconstructed_content = f'SQL Query Result: {{"query": "{sql_query}", "count": 0, "results": []}}'
-                return AIMessage(content=reconstructed_content)
-            else:
-                return AIMessage(content=content)
-        elif msg_type == "system":
-            return SystemMessage(content=content)
+
+def encode_entry(message_dict: Dict[str, Any]) -> bytes:
+    """Encode a serialized message for storage in the Redis list."""
+    if CHAT_HISTORY_CODEC == "json":
+        return orjson.dumps(message_dict)
+    return MSGPACK_ENTRY_VERSION + msgpack.packb(message_dict, use_bin_type=True)
+
+
+def decode_entry_dict(raw_message: bytes) -> Dict[str, Any]:
+    """Decode a stored entry written by either codec."""
+    if raw_message[:1] == MSGPACK_ENTRY_VERSION:
+        return msgpack.unpackb(raw_message[1:], raw=False)
+    return orjson.loads(raw_message)
+
+
+def message_fields(message_dict: Dict[str, Any]) -> Tuple[type, Any]:
+    """Message class and content a stored dictionary deserializes to."""
+    msg_type = message_dict.get("type", "human")
+    content = message_dict.get("content", "")
+
+    # Pick the appropriate message type
+    if msg_type == "human":
+        return HumanMessage, content
+    elif msg_type == "ai":
+        # For AI messages, reconstruct the full content if we have SQL query
+        if "sql_query" in message_dict:
+            # Reconstruct the SQL Query Result format for pagination analysis
+            reconstructed_content = SQL_RESULT_PREFIX + orjson.dumps(
+                {
+                    "query": message_dict["sql_query"],
+                    "params": message_dict.get("sql_params", []),
+                    "count": message_dict.get("row_count", 0),
+                    "results": [],
+                }
+            ).decode()
+            return AIMessage, reconstructed_content
         else:
-            # Fallback to AIMessage for unknown types
-            return AIMessage(content=content)
+            return AIMessage, content
+    elif msg_type == "system":
+        return SystemMessage, content
+    else:
+        # Fallback to AIMessage for unknown types
+        return AIMessage, content
+
+
+@lru_cache(maxsize=4096)
+def decode_entry(raw_message: bytes) -> Tuple[type, Any]:
+    """Decode one stored entry to its message class and content.
+
+    Entries never change once written, yet every turn reloads the whole
+    history, so each one is parsed once per process. The messages themselves
+    are built fresh each time because the graph assigns them ids in place.
+    """
+    return message_fields(decode_entry_dict(raw_message))
 
 
 def get_simple_chat_history(session_id: str) -> SimpleRedisChatHistory:
@@ -1,7 +1,13 @@
+from functools import lru_cache
+
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 
+@lru_cache(maxsize=1)
 def get_llm():
-    """Get the LLM model."""
+    """Get the LLM model.
+
+    Every agent shares one instance, and with it one client connection pool.
+    """
     llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash-lite", temperature=0)
     return llm
@@ -1,15 +1,27 @@
-from typing_extensions import TypedDict
-from typing import List
+from typing_extensions import Annotated, TypedDict
+from typing import List, Optional
 from langchain_core.messages import BaseMessage
+from langgraph.graph.message import add_messages
+
+
+def with_content(*messages: BaseMessage) -> List[BaseMessage]:
+    """Keep only messages with content, for adding to chat_history.
+
+    Nodes add messages through this, so everything in chat_history can be
+    sent to the LLM without filtering it again.
+    """
+    return [message for message in messages if message.content]
 
 
 class State(TypedDict):
-    question: str
     query: str
-    result: str
-    answer: str
-    chat_history: List[BaseMessage]
+    # Nodes return only the messages they add (via with_content); the reducer appends them
+    chat_history: Annotated[List[BaseMessage], add_messages]
     selected_agent: str
     response: str
     cart: List
     store_code: str
+    # Last executed query with a LIMIT clause: {"query": str, "params": list}
+    last_sql: Optional[dict]
+    # Payload of this turn's last SQL tool call; None until SQL has run
+    sql_result: Optional[dict]